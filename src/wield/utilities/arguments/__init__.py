@@ -19,6 +19,11 @@ from .pyargparse import (
     kwdict_argparse,
 )
 
+from .config import (
+    kwdict_config_decode,
+    kwdict_config_load,
+)
+
 from .aid import HintAid
 
 from . import logging
@@ -27,8 +32,11 @@ __all__ = [
     "ArgumentError",
     "grab_kwargs",
     "grab_kwarg_hints",
-    "check_remaining_arguments" "transfer_kw",
+    "check_remaining_arguments",
+    "transfer_kw",
     "kwdict_argparse",
+    "kwdict_config_decode",
+    "kwdict_config_load",
     "HintAid",
     "logging",
 ]
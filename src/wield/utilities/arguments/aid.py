@@ -12,7 +12,7 @@ import time
 import logging
 import contextlib
 
-from ..utilities.strings import padding_remove
+from ..strings import padding_remove
 
 
 class HintAid(object):
@@ -10,7 +10,7 @@
 from wield import declarative
 import numpy as np
 
-from ..utilities import args
+from .. import args
 
 
 class ArgumentError(ValueError):
@@ -37,6 +37,10 @@ def float_check(aid, aname, val):
         raise ArgumentError(("argument {}={} must be a float").format(aname, val))
 
 
+def mapcheck_float(aid, aname, val):
+    return float_check(aid, aname, val)
+
+
 def mapcheck_positive_float(aid, aname, val):
     val = float(val)
     if not (val > 0):
@@ -291,7 +295,29 @@ def cplx_iIjJ_list(val):
     vals3 = []
     for v in vals2:
         vals3.extend(v.split(";"))
-    return [cplx_iIjJ(v) for v in vals3 if v is not ""]
+    return [cplx_iIjJ(v) for v in vals3 if v != ""]
+
+
+def mapcheck_complex(aid, aname, val):
+    try:
+        if isinstance(val, str):
+            return cplx_iIjJ(val)
+        return complex(val)
+    except ValueError:
+        raise ArgumentError(
+            ("argument {}={} must be a complex number").format(aname, val)
+        )
+
+
+def mapcheck_complex_list(aid, aname, val):
+    try:
+        if isinstance(val, str):
+            return cplx_iIjJ_list(val)
+        return [cplx_iIjJ(v) if isinstance(v, str) else complex(v) for v in val]
+    except (ValueError, TypeError):
+        raise ArgumentError(
+            ("argument {}={} must be a list of complex numbers").format(aname, val)
+        )
 
 
 def transfer_kw(kwA, kwB, kwdict, pop=False):
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@caltech.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+Load INI and YAML configuration files using the same kwdict descriptions
+as grab_kwargs. Values are decoded and validated by the "mapcheck" of each
+entry as the file is loaded, so call sites receive typed values.
+"""
+import os
+import copy
+import types
+import collections
+from collections.abc import Mapping
+
+from .base import (
+    _grab_kwargs,
+    check_remaining_arguments,
+)
+from .aid import HintAid
+
+
+# (fname, ftype, strict, id(aid), kwdict fingerprint)
+#     -> ((mtime_ns, size), kwdict, aid, decoded), least recently used first
+_config_cache = collections.OrderedDict()
+_config_cache_max = 64
+
+
+def _kwdict_names(kwdict):
+    """
+    All of the names that entries of kwdict are found under
+    """
+    names = []
+    for argname, kwmeta in kwdict.items():
+        names.append(kwmeta.get("name", argname))
+        names.extend(kwmeta.get("aliases", []))
+        names.extend(kwmeta.get("aliases_bad", []))
+    return names
+
+
+def _match_case(kw, kwdict):
+    """
+    Rename the keys of kw to the names in kwdict that they match ignoring case.
+    Exact matches take precedence.
+    """
+    names = _kwdict_names(kwdict)
+    exact = set(names)
+    lower = dict()
+    for name in names:
+        lower.setdefault(name.lower(), name)
+    for key in list(kw.keys()):
+        if not isinstance(key, str) or key in exact:
+            continue
+        name = lower.get(key.lower(), None)
+        if name is not None and name not in kw:
+            kw[name] = kw.pop(key)
+    return kw
+
+
+def _kwdict_fingerprint(obj):
+    """
+    A hashable description of a kwdict, stable across calls which rebuild the
+    same kwdict literal. Functions are described by their code, defaults and
+    closure, other unhashable objects by their identity (the cache entry holds
+    a reference to the kwdict, so the identities are not reused).
+    """
+    if isinstance(obj, Mapping):
+        return (
+            "map",
+            tuple(
+                sorted(
+                    ((k, _kwdict_fingerprint(v)) for k, v in obj.items()),
+                    key=lambda kv: repr(kv[0]),
+                )
+            ),
+        )
+    if isinstance(obj, (list, tuple)):
+        return (type(obj).__name__,) + tuple(_kwdict_fingerprint(v) for v in obj)
+    if isinstance(obj, (set, frozenset)):
+        return ("set", frozenset(_kwdict_fingerprint(v) for v in obj))
+    if isinstance(obj, types.FunctionType):
+        closure = obj.__closure__ or ()
+        return (
+            "func",
+            obj.__code__,
+            _kwdict_fingerprint(obj.__defaults__ or ()),
+            tuple(_kwdict_fingerprint(c.cell_contents) for c in closure),
+        )
+    try:
+        hash(obj)
+    except TypeError:
+        return ("id", id(obj))
+    return obj
+
+
+def kwdict_config_decode(fdict, kwdict, aid=None, strict=True, case_sensitive=True):
+    """
+    Decode the mapping fdict (as loaded from a config file) using kwdict.
+    Names, aliases and deprecated aliases are resolved and the mapcheck of each
+    entry is applied. Entries with a "kwdict" of their own describe a section
+    (INI) or sub-mapping (YAML) and are decoded recursively.
+
+    The returned dictionary is keyed by the preferred name of each entry.
+    Entries not in the file use their "default" or are left out if they have
+    none. With strict=True, unrecognized keys raise an ArgumentError.
+    With case_sensitive=False, keys match the kwdict names ignoring case, as
+    needed for INI files whose option names are lowercased by configparser.
+    """
+    if aid is None:
+        aid = HintAid()
+    if not isinstance(fdict, Mapping):
+        raise TypeError("config must be a mapping, not {}".format(type(fdict)))
+
+    kw = dict(fdict)
+    if not case_sensitive:
+        _match_case(kw, kwdict)
+    decoded = dict()
+    for argname, kwmeta in kwdict.items():
+        name = kwmeta.get("name", argname)
+        sub_kwdict = kwmeta.get("kwdict", None)
+        if sub_kwdict is not None:
+            kwmeta = dict(kwmeta)
+            kwmeta["mapcheck"] = lambda aid, aname, val, sub=sub_kwdict: (
+                kwdict_config_decode(
+                    val, sub, aid=aid, strict=strict, case_sensitive=case_sensitive
+                )
+            )
+        found = _grab_kwargs(aid, kw, kwmeta, argname)
+        if found:
+            decoded[name] = next(iter(found.values()))
+            continue
+
+        try:
+            default = kwmeta["default"]
+        except KeyError:
+            if sub_kwdict is not None:
+                decoded[name] = kwdict_config_decode(
+                    dict(),
+                    sub_kwdict,
+                    aid=aid,
+                    strict=strict,
+                    case_sensitive=case_sensitive,
+                )
+            continue
+        if callable(default):
+            default = default(aid, argname)
+        decoded[name] = default
+
+    if strict and kw:
+        check_remaining_arguments(kw, kwdict)
+    return decoded
+
+
+def kwdict_config_load(fname, kwdict, ftype=None, aid=None, strict=True, cache=True):
+    """
+    Load and decode a config file (any type supported by file_io, typically
+    INI or YAML) using kwdict, see kwdict_config_decode.
+
+    INI option names are matched to the kwdict ignoring case, since
+    configparser lowercases them.
+
+    Decoded results are cached per file and modification time, so a config
+    shared by many call sites is only parsed and validated once. The cache is
+    also keyed by strict, aid and the content of kwdict, so call sites which
+    rebuild the same kwdict on each call still hit it. The cache stores a
+    copy, so modifying the returned dictionary is safe. It holds the most
+    recently used results of up to 64 loads.
+    """
+    from .. import file_io
+
+    typeB = file_io.determine_type(fname)
+    if ftype is None:
+        ftype = typeB.ftype
+    else:
+        ftype = file_io.type2type[ftype.lower()]
+
+    case_sensitive = ftype != "ini"
+
+    key = None
+    if cache and isinstance(typeB.fname, str):
+        st = os.stat(typeB.fname)
+        stamp = (st.st_mtime_ns, st.st_size)
+        try:
+            key = (
+                typeB.fname,
+                ftype,
+                strict,
+                None if aid is None else id(aid),
+                _kwdict_fingerprint(kwdict),
+            )
+            entry = _config_cache.get(key, None)
+        except TypeError:
+            # a kwdict default or closure which cannot be hashed
+            key = None
+            entry = None
+        if entry is not None:
+            e_stamp, e_kwdict, e_aid, e_decoded = entry
+            if e_stamp == stamp:
+                _config_cache.move_to_end(key)
+                return copy.deepcopy(e_decoded)
+
+    fdict = file_io.load(typeB.fname, ftype=ftype)
+    decoded = kwdict_config_decode(
+        fdict, kwdict, aid=aid, strict=strict, case_sensitive=case_sensitive
+    )
+
+    if key is not None:
+        # kwdict and aid are held so that the ids in the key are not reused
+        _config_cache[key] = (stamp, kwdict, aid, copy.deepcopy(decoded))
+        _config_cache.move_to_end(key)
+        while len(_config_cache) > _config_cache_max:
+            _config_cache.popitem(last=False)
+    return decoded
+
+
+def kwdict_config_cache_clear():
+    _config_cache.clear()
@@ -8,7 +8,7 @@
 """
 """
 import argparse
-from ..utilities.strings import padding_remove
+from ..strings import padding_remove
 
 
 def kwdict_argparse(ap, kwdict, groups_kw=dict()):
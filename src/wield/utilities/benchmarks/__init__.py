@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@caltech.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+Benchmarks of the utilities used in hot paths. These are not tests and are
+not collected by pytest, run them with
+
+python -m wield.utilities.benchmarks
+
+The parameterized suite with JSON results and regression checks against a
+saved baseline is in the suite module, see
+
+python -m wield.utilities.benchmarks.suite --help
+"""
+import time
+
+
+def timeit(func, *args, repeat=3, setup=None, **kwargs):
+    """
+    Call func repeat times, returning the best wall-clock time in seconds.
+
+    setup, if given, is called before each repetition outside of the timed
+    region, and its result is passed as the first argument of func. Use it
+    for inputs which func modifies.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        if setup is not None:
+            call_args = (setup(),) + args
+        else:
+            call_args = args
+        t_start = time.perf_counter()
+        func(*call_args, **kwargs)
+        t_end = time.perf_counter()
+        best = min(best, t_end - t_start)
+    return best
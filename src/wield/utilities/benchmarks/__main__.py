@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@caltech.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+Run the benchmarks using
+
+python -m wield.utilities.benchmarks
+"""
+from . import bench_file_io
+from . import bench_np
+
+
+if __name__ == "__main__":
+    bench_file_io.bench_normalize()
+    bench_file_io.bench_hdf5_parallel()
+    bench_np.bench_continuous_phase()
+    bench_np.bench_batched_inv()
+    bench_np.bench_broadcast_shapes()
+    bench_np.bench_parallel()
+    bench_np.precision_errors()
+    bench_np.bench_precision()
+    bench_np.bench_complex_convert()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@caltech.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+"""
+import os
+import numpy as np
+
+from ..file_io import any_io, types
+from . import timeit
+
+
+def leaf_tree(N_leaves=10**6, N_group=1000):
+    """
+    Build a mixed tree of dicts, lists, tuples and arrays with about N_leaves
+    leaf values.
+    """
+    N_per = max(N_leaves // N_group, 8)
+    tree = dict()
+    for idx in range(N_group):
+        sub = dict()
+        sub["floats"] = [float(v) for v in range(N_per // 2)]
+        sub["array"] = np.arange(N_per // 4, dtype=float)
+        sub["objects"] = [{"a": 1, "b": None} for _ in range(N_per // 16)]
+        sub["complex"] = np.ones(N_per // 16, dtype=complex)
+        sub["tuple"] = tuple(np.float64(v) for v in range(N_per // 16))
+        sub["scalar"] = np.int64(idx)
+        sub["none"] = None
+        tree["g{}".format(idx)] = sub
+    return tree
+
+
+def bench_normalize(N_leaves=10**6):
+    """
+    Time the fused normalization pass of write_any for each distinct set of
+    format features. The normalization modifies the tree in place, so a
+    fresh tree is built outside of the timed region for each repetition.
+    """
+    results = dict()
+    for ftype in ["hdf5", "json"]:
+        visitor = any_io.features2visitor(types.type2features[ftype])
+
+        def run(tree):
+            any_io.normalize_tree(tree, visitor)
+
+        t = timeit(run, setup=lambda: leaf_tree(N_leaves))
+        results[ftype] = t
+        print(
+            "normalize_tree[{}] {} leaves: {:.3f}s ({:.2f} Mleaf/s)".format(
+                ftype, N_leaves, t, N_leaves / t / 1e6
+            )
+        )
+    return results
+
+
+def bench_hdf5_parallel(N_MB=256):
+    """
+    Compare the serial gzip write of h5py against write_hdf5_parallel for a
+    random-walk array of about N_MB megabytes, written to a temporary file.
+    """
+    import shutil
+    import tempfile
+    import h5py
+    from ..file_io import hdf5_io
+
+    N_cols = 4096
+    N_rows = max(1, int(N_MB * 1e6 / 8 / N_cols))
+    arr = np.cumsum(np.random.randn(N_rows, N_cols), axis=1)
+
+    dname = tempfile.mkdtemp()
+    fname = os.path.join(dname, "bench_hdf5_parallel.h5")
+
+    def serial():
+        with h5py.File(fname, "w") as h5F:
+            h5F.create_dataset(
+                "arr", data=arr, chunks=(16, N_cols), compression="gzip", shuffle=True
+            )
+
+    try:
+        t_serial = timeit(serial, repeat=1)
+        stats = hdf5_io.write_hdf5_parallel(fname, {"arr": arr})
+    finally:
+        shutil.rmtree(dname, ignore_errors=True)
+    print(
+        "hdf5 gzip write {:.0f} MB: serial {:.1f} MB/s, parallel {:.1f} MB/s".format(
+            arr.nbytes / 1e6, arr.nbytes / t_serial / 1e6, stats.MBps
+        )
+    )
+    return dict(serial=t_serial, parallel=stats.time)
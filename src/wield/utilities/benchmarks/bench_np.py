@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@caltech.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+"""
+import os
+import numpy as np
+
+from .. import np as wnp
+from . import timeit
+
+
+def continuous_phase_loop(data, op_idx=0, sep=(1.01) * np.pi, deg=False, shiftmod=2):
+    """
+    The previous, 1-D only, implementation of continuous_phase which pops
+    the wrap points one at a time. Kept as the reference for benchmarks.
+    """
+    raw_angle = np.angle(data)
+    diff = np.diff(raw_angle)
+    sep = abs(sep)
+    where_up = list(np.where(diff > sep)[0])
+    where_down = list(np.where(diff < -sep)[0])
+    value_mods = []
+    shift = 0
+
+    def shift_mod(val):
+        return ((shiftmod + val) % (2 * shiftmod)) - shiftmod
+
+    while True:
+        if where_up and where_down:
+            if where_up[-1] > where_down[-1]:
+                shift = shift_mod(shift - 1)
+                where = where_up.pop()
+            else:
+                shift = shift_mod(shift + 1)
+                where = where_down.pop()
+        elif where_up:
+            shift = shift_mod(shift - 1)
+            where = where_up.pop()
+        elif where_down:
+            shift = shift_mod(shift + 1)
+            where = where_down.pop()
+        else:
+            break
+        value_mods.append((where + 1, shift * 2 * np.pi))
+
+    if not value_mods:
+        if np.average(raw_angle) < -np.pi / 4:
+            raw_angle += np.pi * 2
+        if deg:
+            raw_angle *= 180.0 / np.pi
+        return raw_angle
+
+    full_shift = np.empty_like(raw_angle)
+    last_where, shift = value_mods.pop()
+    full_shift[0:last_where] = shift
+    while value_mods:
+        new_where, shift = value_mods.pop()
+        full_shift[last_where:new_where] = shift
+        last_where = new_where
+    full_shift[last_where:] = 0
+
+    raw_angle -= full_shift
+    raw_angle += full_shift[op_idx]
+    while raw_angle[op_idx] < -np.pi:
+        raw_angle += 2 * np.pi
+    while raw_angle[op_idx] > np.pi:
+        raw_angle -= 2 * np.pi
+
+    median = np.sort(raw_angle)[int(len(raw_angle) / 2)]
+    if median < -np.pi / 4:
+        raw_angle += np.pi * 2
+
+    if deg:
+        raw_angle *= 180.0 / np.pi
+    return raw_angle
+
+
+def transfer_functions(N_traces, N_freq, seed=0):
+    """
+    Random complex (N_traces, N_freq) transfer functions with many phase wraps
+    """
+    rng = np.random.default_rng(seed)
+    phase = np.cumsum(rng.normal(0, 0.5, (N_traces, N_freq)), axis=-1)
+    mag = rng.uniform(0.1, 10, (N_traces, N_freq))
+    return mag * np.exp(1j * phase)
+
+
+def bench_continuous_phase(N_traces_list=(1, 10, 100, 1000), N_freq=1000):
+    """
+    Compare unwrapping a stack of traces with one vectorized call against
+    calling the previous loop implementation per trace.
+    """
+    results = dict()
+    for N_traces in N_traces_list:
+        data = transfer_functions(N_traces, N_freq)
+
+        def loop():
+            for trace in data:
+                continuous_phase_loop(trace)
+
+        t_loop = timeit(loop)
+        t_vec = timeit(wnp.continuous_phase, data, axis=-1)
+        results[N_traces] = dict(loop=t_loop, vectorized=t_vec)
+        print(
+            "continuous_phase ({}, {}): loop {:.4f}s, vectorized {:.4f}s, x{:.1f}".format(
+                N_traces, N_freq, t_loop, t_vec, t_loop / t_vec
+            )
+        )
+    return results
+
+
+def bench_batched_inv(N_list=(1000, 10000, 100000), N_mat=20, num_threads=None):
+    """
+    Compare np.linalg.inv of a whole (N, N_mat, N_mat) stack against the
+    chunked batched_inv writing into a preallocated output.
+    """
+    results = dict()
+    rng = np.random.default_rng(0)
+    for N in N_list:
+        M = rng.normal(size=(N, N_mat, N_mat)) + 1j * rng.normal(size=(N, N_mat, N_mat))
+        out = np.empty_like(M)
+        t_np = timeit(np.linalg.inv, M)
+        t_batch = timeit(wnp.batched_inv, M, out=out, num_threads=num_threads)
+        results[N] = dict(numpy=t_np, batched=t_batch)
+        print(
+            "batched_inv ({}, {}, {}): numpy {:.4f}s, batched {:.4f}s, x{:.1f}".format(
+                N, N_mat, N_mat, t_np, t_batch, t_np / t_batch
+            )
+        )
+    return results
+
+
+def broadcast_shapes_grouped(mlist):
+    """
+    The previous broadcast_shapes, which passes the shapes to
+    np.broadcast_shapes in groups of 32. Kept as the reference for benchmarks.
+    """
+    idx = 0
+    bc = None
+    while idx < len(mlist):
+        if idx == 0 or bc == ():
+            v = mlist[idx : idx + 32]
+            bc = np.broadcast_shapes(*[_.shape for _ in v])
+            idx += 32
+        else:
+            v = mlist[idx : idx + 31]
+            bc = np.broadcast_shapes(bc, *[_.shape for _ in v])
+            idx += 31
+    return bc
+
+
+def bench_broadcast_shapes(N_operands=10**4):
+    """
+    Broadcast N_operands arrays of a few distinct shapes, comparing the
+    grouped reference against broadcast_shapes and timing broadcast_deep.
+    """
+    shapes = [(100,), (1, 100), (10, 1), (10, 100), ()]
+    mlist = [np.empty(shapes[idx % len(shapes)]) for idx in range(N_operands)]
+
+    t_grouped = timeit(broadcast_shapes_grouped, mlist)
+    t_direct = timeit(wnp.broadcast_shapes, mlist)
+    t_deep = timeit(wnp.broadcast_deep, mlist)
+    print(
+        "broadcast_shapes ({}): grouped {:.4f}s, direct {:.4f}s, x{:.1f}".format(
+            N_operands, t_grouped, t_direct, t_grouped / t_direct
+        )
+    )
+    print("broadcast_deep ({}): {:.4f}s".format(N_operands, t_deep))
+    return dict(grouped=t_grouped, direct=t_direct, deep=t_deep)
+
+
+def bench_parallel(threads_list=None, N_traces=256, N_freq=10**4):
+    """
+    Time the helpers with a parallel backend at increasing thread counts
+    (by default powers of 2 up to the core count), reporting the speedup
+    relative to a single thread.
+    """
+    if threads_list is None:
+        N_cores = os.cpu_count() or 1
+        threads_list = [2**k for k in range(N_cores.bit_length()) if 2**k <= N_cores]
+        if threads_list[-1] != N_cores:
+            threads_list.append(N_cores)
+
+    data = transfer_functions(N_traces, N_freq)
+    F = np.linspace(1, 1e4, N_freq)
+    a = data.real
+    mask = a.reshape(-1) > 0
+    M = np.random.default_rng(0).normal(size=(N_traces * 64, 8, 8))
+
+    cases = dict(
+        continuous_phase=lambda: wnp.continuous_phase(data),
+        group_delay=lambda: wnp.group_delay(F, data),
+        matrix_stack=lambda: wnp.matrix_stack([[a, 1], [0, a]]),
+        generate_sections=lambda: wnp.generate_sections_array(mask),
+        batched_inv=lambda: wnp.batched_inv(M),
+    )
+    results = dict()
+    prev = wnp.get_num_threads()
+    try:
+        for name, func in cases.items():
+            times = dict()
+            for num_threads in threads_list:
+                wnp.set_num_threads(num_threads)
+                times[num_threads] = timeit(func)
+            results[name] = times
+            t_1 = times.get(1, times[threads_list[0]])
+            print(
+                "{} ({}, {}): ".format(name, N_traces, N_freq)
+                + ", ".join(
+                    "{} threads {:.4f}s x{:.1f}".format(n, t, t_1 / t)
+                    for n, t in times.items()
+                )
+            )
+    finally:
+        wnp.set_num_threads(prev)
+    return results
+
+
+def _phase_error(a, b):
+    """
+    Largest phase difference, ignoring whole turns
+    """
+    d = np.asarray(a, dtype=float) - np.asarray(b, dtype=float)
+    return np.max(np.abs((d + np.pi) % (2 * np.pi) - np.pi))
+
+
+def precision_errors(N_traces=16, N_freq=10**4):
+    """
+    Report the error of the single precision policy against double
+    precision. The errors are bounded by test/test_precision.py.
+    """
+    data = transfer_functions(N_traces, N_freq)
+    F = np.linspace(1, 1e4, N_freq)
+    errors = dict()
+
+    # the turn offsets may be decided differently for traces at the
+    # threshold, so whole turns are ignored
+    errors["continuous_phase"] = _phase_error(
+        wnp.continuous_phase(data, precision="single"),
+        wnp.continuous_phase(data, precision="double"),
+    )
+    mag_s, ang_s = wnp.mag_phase_signed(data, deg=False, precision="single")
+    mag_d, ang_d = wnp.mag_phase_signed(data, deg=False, precision="double")
+    # near the branch at 3pi/4 the sign of mag may flip with a half turn
+    errors["mag_phase_signed"] = np.max(
+        np.abs(np.abs(mag_s) - np.abs(mag_d)) / np.abs(mag_d)
+    )
+    # compared as the phase steps, the delay times the frequency step
+    gd_s = wnp.group_delay(F, data, mult=1, precision="single")[1]
+    gd_d = wnp.group_delay(F, data, mult=1, precision="double")[1]
+    errors["group_delay"] = np.max(np.abs(gd_s - gd_d) * np.diff(F))
+    errors["logspaced"] = np.max(
+        np.abs(
+            wnp.logspaced(1e-3, 1e5, 10**5, precision="single")
+            / wnp.logspaced(1e-3, 1e5, 10**5, precision="double")
+            - 1
+        )
+    )
+    a = data[0]
+    ms_s = wnp.matrix_stack([[a, 1], [0, a]], precision="single")
+    ms_d = wnp.matrix_stack([[a, 1], [0, a]], precision="double")
+    errors["matrix_stack"] = np.max(np.abs(ms_s - ms_d) / np.maximum(np.abs(ms_d), 1))
+    plan_s = wnp.matrix_stack_plan([[a, 1], [0, a]], precision="single")
+    errors["matrix_stack_plan"] = np.max(
+        np.abs(plan_s.build([[a, 1], [0, a]]) - ms_d) / np.maximum(np.abs(ms_d), 1)
+    )
+    bs_s = wnp.matrix_stack_sparse([[a, 1], [0, a]], precision="single")
+    bs_d = wnp.matrix_stack_sparse([[a, 1], [0, a]], precision="double")
+    inv_s = bs_s.inv().dense()
+    inv_d = bs_d.inv().dense()
+    errors["BlockStack"] = np.max(np.abs(inv_s - inv_d) / np.maximum(np.abs(inv_d), 1))
+
+    for name, err in errors.items():
+        print("{} single precision error {:.2e}".format(name, err))
+    return errors
+
+
+def bench_precision(N_traces=64, N_freq=10**5):
+    """
+    Compare the time and output memory of the double and single precision
+    policies, for complex128 input data.
+    """
+    data = transfer_functions(N_traces, N_freq)
+    F = np.linspace(1, 1e4, N_freq)
+    cases = dict(
+        continuous_phase=lambda precision: wnp.continuous_phase(
+            data, precision=precision
+        ),
+        mag_phase_signed=lambda precision: wnp.mag_phase_signed(
+            data, precision=precision
+        )[0],
+        group_delay=lambda precision: wnp.group_delay(F, data, precision=precision)[1],
+        matrix_stack=lambda precision: wnp.matrix_stack(
+            [[data, 1], [0, data]], precision=precision
+        ),
+        logspaced=lambda precision: wnp.logspaced(
+            1, 1e4, N_traces * N_freq, precision=precision
+        ),
+    )
+    results = dict()
+    for name, func in cases.items():
+        times = dict()
+        nbytes = dict()
+        for precision in ["double", "single"]:
+            times[precision] = timeit(func, precision)
+            nbytes[precision] = func(precision).nbytes
+        results[name] = dict(time=times, nbytes=nbytes)
+        print(
+            "{}: double {:.4f}s {:.0f} MB, single {:.4f}s {:.0f} MB, x{:.1f}".format(
+                name,
+                times["double"],
+                nbytes["double"] / 1e6,
+                times["single"],
+                nbytes["single"] / 1e6,
+                times["double"] / times["single"],
+            )
+        )
+    return results
+
+
+def bench_complex_convert(N=10**7):
+    """
+    Compare separate np.abs, np.log10 and np.angle passes against the
+    chunked single pass of complex_convert, for N complex points.
+    """
+    rng = np.random.default_rng(0)
+    v = rng.normal(size=N) + 1j * rng.normal(size=N)
+    out = {field: np.empty(N) for field in ["mag", "db", "phase"]}
+
+    def separate():
+        mag = np.abs(v)
+        db = 20 * np.log10(mag)
+        phase = np.angle(v)
+        return mag, db, phase
+
+    t_separate = timeit(separate)
+    t_fused = timeit(wnp.complex_convert, v, out=out)
+    print(
+        "complex_convert ({}): separate {:.4f}s, fused {:.4f}s, x{:.1f}".format(
+            N, t_separate, t_fused, t_separate / t_fused
+        )
+    )
+    return dict(separate=t_separate, fused=t_fused)
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@caltech.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+Parameterized benchmark suite with regression tracking. Results are stored as
+JSON, keyed by "case[size]", and can be compared against a saved baseline.
+Run it offline with
+
+python -m wield.utilities.benchmarks.suite --save results.json
+python -m wield.utilities.benchmarks.suite --baseline results.json
+
+The second form exits with status 1 if any case is slower than the baseline
+by more than the threshold (20% by default).
+"""
+import os
+import sys
+import copy
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import numpy as np
+
+from .. import np as wnp
+from .. import file_io
+from . import timeit
+
+
+# name -> (setup function, sizes)
+cases = dict()
+
+
+def register(name, sizes):
+    """
+    Decorator adding a benchmark case. The decorated setup function is called
+    with each size and returns the function to time (with no arguments).
+    The setup itself is not timed.
+
+    If the returned function has a "setup" attribute, it is called before
+    each timed call, untimed, and its result passed as the argument (see
+    timeit). A "cleanup" attribute is called once the case is done.
+    """
+
+    def deco(setup):
+        cases[name] = (setup, tuple(sizes))
+        return setup
+
+    return deco
+
+
+@register("matrix_stack", sizes=[10**3, 10**5])
+def setup_matrix_stack(N):
+    a = np.linspace(0, 1, N) + 1j
+    arr = [[a, 1, 0, a], [0, a, 1, 0], [2, 0, a, 1], [a, 0, 0, a]]
+    return lambda: wnp.matrix_stack(arr)
+
+
+@register("broadcast_shapes", sizes=[10**2, 10**4])
+def setup_broadcast_shapes(N):
+    shapes = [(100,), (1, 100), (10, 1), ()]
+    mlist = [np.empty(shapes[idx % len(shapes)]) for idx in range(N)]
+    return lambda: wnp.broadcast_shapes(mlist)
+
+
+@register("continuous_phase", sizes=[10**4, 10**6])
+def setup_continuous_phase(N):
+    from .bench_np import transfer_functions
+
+    data = transfer_functions(max(1, N // 10**4), min(N, 10**4))
+    return lambda: wnp.continuous_phase(data)
+
+
+@register("search_local_sorted", sizes=[10**3, 10**5])
+def setup_search_local_sorted(N):
+    x = np.linspace(0, 100, N)
+    y = np.sin(x / 3)
+    return lambda: wnp.search_local_sorted(x, y, 50, 0.5)
+
+
+@register("search_local_sorted_index", sizes=[10**3, 10**5])
+def setup_search_local_sorted_index(N):
+    x = np.linspace(0, 100, 10**4)
+    y = np.sin(x / 3)
+    index = wnp.MonotoneSegmentIndex(x, y)
+    rng = np.random.default_rng(0)
+    x_q = rng.uniform(0, 100, N)
+    y_q = rng.uniform(-1, 1, N)
+    return lambda: index.search(x_q, y_q)
+
+
+@register("generate_sections", sizes=[10**5, 10**7])
+def setup_generate_sections(N):
+    rng = np.random.default_rng(0)
+    barray = np.cumsum(rng.normal(size=N)) > 0
+    return lambda: wnp.generate_sections_array(barray, reconnect_length=10)
+
+
+@register("domain_sort", sizes=[10**4, 10**6])
+def setup_domain_sort(N):
+    rng = np.random.default_rng(0)
+    X = rng.uniform(size=N)
+    Y = rng.normal(size=(4, N))
+    return lambda: wnp.domain_sort(X, *Y)
+
+
+def _setup_roundtrip(ftype, N):
+    rng = np.random.default_rng(0)
+    fdict = dict(
+        data=rng.normal(size=N),
+        response=rng.normal(size=N) + 1j * rng.normal(size=N),
+        meta=dict(name="bench", N=N),
+    )
+    dname = tempfile.mkdtemp()
+    fname = os.path.join(dname, "roundtrip.{}".format(ftype))
+
+    def roundtrip(fdict):
+        file_io.save(fname, fdict)
+        file_io.load(fname)
+
+    # saving normalizes the tree in place, so each call gets a fresh copy
+    roundtrip.setup = lambda: copy.deepcopy(fdict)
+    # the temporary directory is removed with the closure
+    roundtrip.cleanup = lambda: shutil.rmtree(dname, ignore_errors=True)
+    return roundtrip
+
+
+@register("file_io_hdf5", sizes=[10**3, 10**6])
+def setup_file_io_hdf5(N):
+    return _setup_roundtrip("h5", N)
+
+
+@register("file_io_json", sizes=[10**3, 10**5])
+def setup_file_io_json(N):
+    return _setup_roundtrip("json", N)
+
+
+def case_key(name, size):
+    return "{}[{}]".format(name, size)
+
+
+def run_suite(names=None, max_size=None, repeat=5, verbose=True):
+    """
+    Run the registered cases (all, or those in names) at each size up to
+    max_size, returning a dictionary of the best times in seconds keyed by
+    case_key.
+    """
+    results = dict()
+    for name, (setup, sizes) in cases.items():
+        if names is not None and name not in names:
+            continue
+        for size in sizes:
+            if max_size is not None and size > max_size:
+                continue
+            func = setup(size)
+            try:
+                t = timeit(func, repeat=repeat, setup=getattr(func, "setup", None))
+            finally:
+                cleanup = getattr(func, "cleanup", None)
+                if cleanup is not None:
+                    cleanup()
+            key = case_key(name, size)
+            results[key] = t
+            if verbose:
+                print("{:<40} {:.6f}s".format(key, t))
+    return results
+
+
+def save_results(fname, results):
+    """
+    Save results as JSON, along with the versions and machine they were
+    measured on.
+    """
+    file_io.save(
+        fname,
+        dict(
+            results=results,
+            numpy=np.__version__,
+            python=platform.python_version(),
+            machine=platform.machine(),
+            processor=platform.processor(),
+            cpu_count=os.cpu_count(),
+            time=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        ),
+    )
+
+
+def load_results(fname):
+    return dict(file_io.load(fname)["results"])
+
+
+def compare(results, baseline, threshold=0.2):
+    """
+    Compare results against baseline, returning a dictionary of the cases
+    slower than the baseline by more than the fractional threshold, mapping
+    to (time, baseline time). Cases missing from either are skipped.
+    """
+    regressions = dict()
+    for key, t in results.items():
+        t_base = baseline.get(key, None)
+        if t_base is None:
+            continue
+        if t > t_base * (1 + threshold):
+            regressions[key] = (t, t_base)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--save", help="JSON file to save the results into")
+    parser.add_argument("--baseline", help="JSON file of results to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="fractional slowdown to flag as a regression",
+    )
+    parser.add_argument("--max-size", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("cases", nargs="*", help="case names, default all")
+    args = parser.parse_args(argv)
+
+    results = run_suite(
+        names=args.cases or None, max_size=args.max_size, repeat=args.repeat
+    )
+    if args.save:
+        save_results(args.save, results)
+
+    if args.baseline:
+        regressions = compare(
+            results, load_results(args.baseline), threshold=args.threshold
+        )
+        for key, (t, t_base) in regressions.items():
+            print(
+                "REGRESSION {}: {:.6f}s vs baseline {:.6f}s (+{:.0f}%)".format(
+                    key, t, t_base, 100 * (t / t_base - 1)
+                )
+            )
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
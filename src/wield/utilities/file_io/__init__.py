@@ -18,6 +18,12 @@ from .csv_io import (
     load_csv,
 )
 
+from .dataset_io import (
+    DatasetBunch,
+    load_dataset,
+    write_dataset,
+)
+
 from .types import (
     type2type,
     ext2type,
@@ -31,19 +37,41 @@ from .utilities import (
 )
 
 
-def save(fname, d):
+def save(fname, d, ftype=None):
+    """
+    Save the dictionary d. fname may be a filename, whose type is determined
+    from its extension or "::ftype" suffix, or a writeable file-like object,
+    in which case ftype must be given.
+    """
     typeB = determine_type(fname)
+    if ftype is None:
+        ftype = typeB.ftype
+    else:
+        ftype = type2type[ftype.lower()]
+    if ftype is None:
+        raise RuntimeError("ftype must be specified to save into a file-like object")
     write_any(
         fname=typeB.fname,
-        ftype=typeB.ftype,
+        ftype=ftype,
         fdict=d,
     )
 
 
 def load(fname, ftype=None):
+    """
+    Load a dictionary from fname, which may be a filename, a readable file-like
+    object (such as a tar member or an io.BytesIO), or a bytes-like buffer
+    (bytes, bytearray, memoryview). The latter two require ftype.
+    """
     typeB = determine_type(fname)
     if ftype is None:
         ftype = typeB.ftype
+    else:
+        ftype = type2type[ftype.lower()]
+    if ftype is None:
+        raise RuntimeError(
+            "ftype must be specified to load from a file-like object or buffer"
+        )
 
     return load_any(
         fname=typeB.fname,
@@ -96,6 +124,9 @@ __all__ = [
     "load_any",
     "write_any",
     "load_csv",
+    "DatasetBunch",
+    "load_dataset",
+    "write_dataset",
     "type2type",
     "ext2type",
     "type2features",
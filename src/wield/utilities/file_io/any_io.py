@@ -57,6 +57,10 @@ def load_any(
         from . import matlab_io
 
         fdict = matlab_io.load_matlab(fname)
+    elif ftype == "dataset":
+        from . import dataset_io
+
+        fdict = dataset_io.load_dataset(fname)
     elif ftype == "special":
         if special is None:
             raise NotImplementedError("special data type not supported")
@@ -72,35 +76,165 @@ def load_any(
     return fdict
 
 
-def cull_None(obj):
-    if isinstance(obj, abc.Mapping):
-        dels = []
-        for k, v in obj.items():
-            v2 = cull_None(v)
-            if v2 is None:
-                dels.append(k)
-            else:
-                obj[k] = v2
-        for k in dels:
-            del obj[k]
-        return obj
-    elif isinstance(obj, np.ndarray):
+def _complex_encode(obj):
+    objD = collections.OrderedDict()
+    objD["<type>"] = "complex"
+    if isinstance(obj, np.ndarray):
+        # bulk conversion, equivalent to str() on each element
+        objD["<"] = obj.astype(str).tolist()
+    else:
+        objD["<"] = str(obj)
+    return objD
+
+
+# marks a slot holding a list that must be converted back into a tuple after
+# its elements have been visited
+_TUPLE_FINALIZE = ("tuple_finalize",)
+
+# python types which are never modified by normalization
+_scalar_types = frozenset([int, float, bool, str])
+
+
+class NormalizeVisitor(object):
+    """
+    Describes the normalization needed to write a tree of dictionaries, lists
+    and arrays into a format with the given features. It is applied by
+    normalize_tree, which performs all of the normalizations in a single
+    traversal.
+
+    cull_None: remove None values from mappings
+    complex: format supports complex numbers. If False, complex numbers and
+      arrays are encoded as {'<type>': 'complex', '<': str-values}.
+    ndarray: format supports arrays. If False, arrays and numpy scalars are
+      converted to (nested) lists and python scalars, and tuples become lists.
+    """
+
+    def __init__(self, cull_None=True, complex=True, ndarray=True):
+        self.cull_None = cull_None
+        self.complex = complex
+        self.ndarray = ndarray
+
+    def visit(self, obj):
+        """
+        Returns the normalized object and a flag indicating if its elements
+        must also be visited.
+        """
+        if isinstance(obj, abc.Mapping):
+            return obj, True
+        elif isinstance(obj, np.ndarray):
+            return self.visit_ndarray(obj)
+        elif isinstance(obj, (list, tuple)):
+            if not self.complex:
+                # lists of numbers are converted in bulk as arrays
+                try:
+                    arr = np.asarray(obj)
+                except ValueError:
+                    # ragged
+                    arr = None
+                # only numbers, as mixed lists would be coerced into strings
+                if arr is not None and arr.dtype.kind in "biufc":
+                    return self.visit_ndarray(arr)
+            return obj, True
+        elif isinstance(obj, np.generic):
+            if self.ndarray and self.complex:
+                return obj, False
+            obj = obj.item()
+        if isinstance(obj, complex) and not self.complex:
+            return _complex_encode(obj), False
+        return obj, False
+
+    def visit_ndarray(self, obj):
         if obj.dtype == object:
-            for idx, v in np.ndenumerate(obj):
-                obj[idx] = cull_None(v)
-            return obj
-        else:
-            return obj
-    elif isinstance(obj, list):
-        for idx, v in enumerate(obj):
-            obj[idx] = cull_None(v)
-        return obj
-    elif isinstance(obj, tuple):
-        obj2 = [None] * len(obj)
-        for idx, v in enumerate(obj):
-            obj2[idx] = cull_None(v)
-        return tuple(obj2)
-    return obj
+            if self.ndarray:
+                return obj, True
+            return obj.tolist(), True
+        elif not self.complex and np.iscomplexobj(obj):
+            return _complex_encode(obj), False
+        elif not self.ndarray:
+            return obj.tolist(), False
+        return obj, False
+
+
+# one visitor per combination of format features
+_feature_visitors = dict()
+
+
+def features2visitor(features):
+    """
+    Returns the NormalizeVisitor for the format features from types.type2features
+    """
+    key = (bool(features["complex"]), bool(features["ndarray"]))
+    visitor = _feature_visitors.get(key, None)
+    if visitor is None:
+        visitor = NormalizeVisitor(
+            cull_None=True,
+            complex=key[0],
+            ndarray=key[1],
+        )
+        _feature_visitors[key] = visitor
+    return visitor
+
+
+def normalize_tree(obj, visitor):
+    """
+    Iteratively walk the tree of mappings, lists, tuples and object arrays,
+    applying the visitor to every element. Mappings and lists are modified in
+    place and the (possibly replaced) root object is returned.
+
+    This replaces the separate recursive cull_None, fix_complex_write and
+    fix_ndarray passes with a single traversal that has no recursion limit.
+    """
+    root = [obj]
+    # stack of (container, key) slots to visit
+    stack = [(root, 0)]
+    cull_None = visitor.cull_None
+    visit = visitor.visit
+    while stack:
+        cont, key = stack.pop()
+        if key is _TUPLE_FINALIZE:
+            tcont, tkey, lst = cont
+            tcont[tkey] = tuple(lst)
+            continue
+        val, descend = visit(cont[key])
+        if descend:
+            if isinstance(val, abc.Mapping):
+                if cull_None:
+                    dels = [k for k, v in val.items() if v is None]
+                    for k in dels:
+                        del val[k]
+                for k, v in val.items():
+                    if v is None:
+                        continue
+                    stack.append((val, k))
+            elif isinstance(val, np.ndarray):
+                # object arrays. The element types are checked in bulk and
+                # only elements which could change are visited
+                if not val.flags.c_contiguous:
+                    val = val.copy()
+                flat = val.reshape(-1)
+                if not _scalar_types.issuperset(map(type, flat)):
+                    for idx, v in enumerate(flat):
+                        if type(v) not in _scalar_types:
+                            stack.append((flat, idx))
+            elif _scalar_types.issuperset(map(type, val)):
+                # checked in bulk, nothing within the list can change
+                if isinstance(val, tuple) and not visitor.ndarray:
+                    val = list(val)
+            else:
+                if isinstance(val, tuple):
+                    lst = list(val)
+                    if visitor.ndarray:
+                        stack.append(((cont, key, lst), _TUPLE_FINALIZE))
+                    val = lst
+                for idx, v in enumerate(val):
+                    if type(v) not in _scalar_types:
+                        stack.append((val, idx))
+        cont[key] = val
+    return root[0]
+
+
+def cull_None(obj):
+    return normalize_tree(obj, NormalizeVisitor(cull_None=True))
 
 
 def normalize_ndarray(obj):
@@ -120,38 +254,9 @@ def normalize_ndarray(obj):
 
 
 def fix_complex_write(obj):
-    normalize_ndarray(obj)
-    if isinstance(obj, abc.Mapping):
-        for k, v in obj.items():
-            obj[k] = fix_complex_write(v)
-        return obj
-    elif isinstance(obj, np.ndarray):
-        if np.iscomplexobj(obj):
-            objD = collections.OrderedDict()
-            objD['<type>'] = 'complex'
-            objD['<'] = list([str(o) for o in obj])
-            return objD
-        elif obj.dtype == object:
-            for idx, v in np.ndenumerate(obj):
-                obj[idx] = fix_complex_write(v)
-            return obj
-        else:
-            return obj
-    elif isinstance(obj, list):
-        for idx, v in enumerate(obj):
-            obj[idx] = fix_complex_write(v)
-        return obj
-    elif isinstance(obj, tuple):
-        obj2 = [None] * len(obj)
-        for idx, v in enumerate(obj):
-            obj2[idx] = fix_complex_write(v)
-        return tuple(obj2)
-    elif isinstance(obj, complex):
-        objD = collections.OrderedDict()
-        objD['<type>'] = 'complex'
-        objD['<'] = str(obj)
-        obj = objD
-    return obj
+    return normalize_tree(
+        obj, NormalizeVisitor(cull_None=False, complex=False, ndarray=True)
+    )
 
 
 def fix_complex_read(obj):
@@ -160,7 +265,8 @@ def fix_complex_read(obj):
         if type_attr == 'complex':
             val = obj['<']
             if isinstance(val, list):
-                val = [complex(v) for v in val]
+                # bulk conversion, also handles nested lists from N-D arrays
+                val = np.asarray(val).astype(complex).tolist()
                 return val
             else:
                 return complex(val)
@@ -181,30 +287,9 @@ def fix_complex_read(obj):
 
 
 def fix_ndarray(obj):
-    if isinstance(obj, abc.Mapping):
-        for k, v in obj.items():
-            obj[k] = fix_ndarray(v)
-        return obj
-    elif isinstance(obj, np.ndarray):
-        if obj.dtype == object:
-            obj = fix_ndarray(obj.tolist())
-            return obj
-        else:
-            obj = obj.tolist()
-            return obj
-    elif isinstance(obj, np.generic):
-        #return np.asscalar(obj)
-        return obj.item()
-    elif isinstance(obj, list):
-        for idx, v in enumerate(obj):
-            obj[idx] = fix_ndarray(v)
-        return obj
-    elif isinstance(obj, tuple):
-        obj2 = [None] * len(obj)
-        for idx, v in enumerate(obj):
-            obj2[idx] = fix_ndarray(v)
-        return tuple(obj2)
-    return obj
+    return normalize_tree(
+        obj, NormalizeVisitor(cull_None=False, complex=True, ndarray=False)
+    )
 
 
 def write_any(
@@ -218,18 +303,10 @@ def write_any(
     # if fdict_orig is None:
     #     fdict_orig = fdict
     #     fdict = copy.deepcopy(fdict)
-    cull_None(fdict)
-    if not features["complex"]:
-        # if fdict_orig is None:
-        #     fdict_orig = fdict
-        #     fdict = copy.deepcopy(fdict)
-        fix_complex_write(fdict)
 
-    if not features["ndarray"]:
-        # if fdict_orig is None:
-        #     fdict_orig = fdict
-        #     fdict = copy.deepcopy(fdict)
-        fix_ndarray(fdict)
+    # culls None, and if needed, encodes complex values and converts arrays
+    # to lists, all in one pass
+    fdict = normalize_tree(fdict, features2visitor(features))
 
     if ftype == "hdf5":
         from . import hdf5_io
@@ -255,6 +332,10 @@ def write_any(
         from . import ini_io
 
         fdict = ini_io.ini_write(fname, fdict)
+    elif ftype == "dataset":
+        from . import dataset_io
+
+        fdict = dataset_io.write_dataset(fname, fdict)
     elif ftype == "csv":
         raise RuntimeError("Unsupported Output Type")
     return fdict
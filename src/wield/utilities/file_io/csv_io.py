@@ -10,6 +10,8 @@
 
 import numpy as np
 
+from .utilities import fname_as_fileobj
+
 
 def load_csv(fname, parse_str, parse_map):
     """
@@ -30,7 +32,7 @@ def load_csv(fname, parse_str, parse_map):
         key_gen.append(parse_map[sk])
 
     farr = np.genfromtxt(
-        fname,
+        fname_as_fileobj(fname),
         delimiter=delimiter,
         filling_values=float("NaN"),
     )
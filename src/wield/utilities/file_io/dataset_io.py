@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@caltech.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+Directory-backed "dataset" format. Each top-level key of the dictionary lives
+in its own file within the directory, so large result trees can be partially
+read and partially rewritten, and several workers may write different keys
+without contending on a single monolithic file.
+
+The per-key file type is chosen from the value:
+ - non-object ndarrays and numeric lists or tuples are stored as .npy
+ - sub-dictionaries are stored as .h5
+ - everything else (scalars, strings, heterogeneous lists) is stored as .json
+
+There is no index file. The keys are the file names in the directory, which
+keeps concurrent writers from contending over shared metadata.
+"""
+import os
+import threading
+from collections import abc
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from . import any_io
+from . import types
+from .utilities import fname_is_path
+
+
+ext2dstype = {
+    ".npy": "npy",
+    ".h5": "hdf5",
+    ".json": "json",
+}
+
+dstype2ext = {v: k for k, v in ext2dstype.items()}
+
+
+def dataset_value_type(value):
+    """
+    Determine which per-key file type should hold value.
+    """
+    if isinstance(value, abc.Mapping):
+        return "hdf5"
+    if isinstance(value, (list, tuple)):
+        try:
+            value = np.asarray(value)
+        except ValueError:
+            # ragged lists
+            return "json"
+        # don't let numpy coerce heterogeneous lists into strings
+        if value.dtype.kind not in "biufc":
+            return "json"
+    if isinstance(value, np.ndarray):
+        if value.dtype != object:
+            return "npy"
+    return "json"
+
+
+def _key_check(key):
+    if not isinstance(key, str):
+        raise TypeError("dataset keys must be strings, not {}".format(type(key)))
+    if (not key) or key.startswith(".") or (os.sep in key) or ("/" in key):
+        raise KeyError("key '{}' is not usable as a dataset file name".format(key))
+
+
+def _key_files(dname):
+    """
+    Map the keys to the file names present in the dataset directory
+    """
+    kfiles = dict()
+    try:
+        fnames = os.listdir(dname)
+    except FileNotFoundError:
+        return kfiles
+    for fname in fnames:
+        key, ext = os.path.splitext(fname)
+        if ext not in ext2dstype or key.startswith("."):
+            continue
+        kfiles[key] = fname
+    return kfiles
+
+
+def load_key(fpath, mmap_mode=None):
+    """
+    Load a single dataset key file.
+    """
+    ext = os.path.splitext(fpath)[1]
+    dstype = ext2dstype[ext]
+    if dstype == "npy":
+        return np.load(fpath, mmap_mode=mmap_mode, allow_pickle=False)
+    elif dstype == "hdf5":
+        from . import hdf5_io
+
+        return hdf5_io.load_hdf5(fpath)
+    elif dstype == "json":
+        from . import json_io
+
+        return any_io.fix_complex_read(json_io.load_json(fpath))
+    raise RuntimeError("Unsupported dataset file type")
+
+
+def write_key(dname, key, value):
+    """
+    Write a single key into the dataset directory. The file is written under a
+    temporary name and then atomically moved into place so that readers never
+    see a partial file. Any previous file for this key of a different type is
+    removed.
+    """
+    _key_check(key)
+    dstype = dataset_value_type(value)
+    ext = dstype2ext[dstype]
+    fpath = os.path.join(dname, key + ext)
+    # hidden and unique per process/thread so that concurrent writers don't clash
+    fpath_tmp = os.path.join(
+        dname, ".{}{}.{}-{}.tmp".format(key, ext, os.getpid(), threading.get_ident())
+    )
+
+    try:
+        if dstype == "npy":
+            with open(fpath_tmp, "wb") as F:
+                np.save(F, np.asarray(value), allow_pickle=False)
+        elif dstype == "hdf5":
+            from . import hdf5_io
+
+            any_io.cull_None(value)
+            hdf5_io.write_hdf5(fpath_tmp, value)
+        else:
+            from . import json_io
+
+            value = any_io.normalize_tree(
+                value, any_io.features2visitor(types.type2features["json"])
+            )
+            json_io.write_json(fpath_tmp, value)
+        os.replace(fpath_tmp, fpath)
+    finally:
+        if os.path.exists(fpath_tmp):
+            os.remove(fpath_tmp)
+
+    for ext_other in ext2dstype:
+        if ext_other == ext:
+            continue
+        try:
+            os.remove(os.path.join(dname, key + ext_other))
+        except FileNotFoundError:
+            pass
+    return fpath
+
+
+def close_key(value):
+    """
+    Close the file handle held by a loaded key, if any. The .h5 keys are read
+    lazily and keep their file open until closed.
+    """
+    from wield.bunch.hdf_deep_bunch import HDFDeepBunch
+
+    if isinstance(value, HDFDeepBunch):
+        hdf = value.hdf
+        if hdf is not None and hdf.id.valid:
+            hdf.file.close()
+
+
+def delete_key(dname, key):
+    removed = False
+    for ext in ext2dstype:
+        try:
+            os.remove(os.path.join(dname, key + ext))
+            removed = True
+        except FileNotFoundError:
+            pass
+    if not removed:
+        raise KeyError(key)
+
+
+class DatasetBunch(abc.MutableMapping):
+    """
+    Mapping view of a dataset directory. Keys are loaded lazily on first access
+    and cached. Setting or deleting a key immediately writes or removes its
+    file, without touching the other keys.
+
+    mmap_mode is passed to np.load for the .npy keys, allowing arrays larger
+    than memory to be accessed.
+
+    The .h5 keys keep their files open while cached. They are closed when the
+    key is overwritten or deleted, and by close().
+    """
+
+    def __init__(self, dname, mmap_mode=None, writeable=True):
+        self._dname = dname
+        self._mmap_mode = mmap_mode
+        self._writeable = writeable
+        self._cache = dict()
+
+    @property
+    def dname(self):
+        return self._dname
+
+    def _files(self):
+        return _key_files(self._dname)
+
+    def __getitem__(self, key):
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        fname = self._files()[key]
+        value = load_key(os.path.join(self._dname, fname), mmap_mode=self._mmap_mode)
+        self._cache[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        if not self._writeable:
+            raise RuntimeError("dataset {} opened read-only".format(self._dname))
+        os.makedirs(self._dname, exist_ok=True)
+        write_key(self._dname, key, value)
+        self._evict(key)
+
+    def __delitem__(self, key):
+        if not self._writeable:
+            raise RuntimeError("dataset {} opened read-only".format(self._dname))
+        self._evict(key)
+        delete_key(self._dname, key)
+
+    def __contains__(self, key):
+        return key in self._cache or key in self._files()
+
+    def __iter__(self):
+        return iter(sorted(self._files()))
+
+    def __len__(self):
+        return len(self._files())
+
+    def update_parallel(self, fdict, max_workers=None):
+        """
+        Write many keys at once using a thread pool.
+        """
+        if not self._writeable:
+            raise RuntimeError("dataset {} opened read-only".format(self._dname))
+        write_dataset(self._dname, fdict, mode="a", max_workers=max_workers)
+        for key in fdict:
+            self._evict(key)
+
+    def _evict(self, key):
+        value = self._cache.pop(key, None)
+        if value is not None:
+            close_key(value)
+
+    def close(self):
+        """
+        Close the files held open by the cached keys and empty the cache.
+        """
+        for key in list(self._cache):
+            self._evict(key)
+
+    def __repr__(self):
+        return "{0}({1!r}, keys={2})".format(
+            self.__class__.__name__, self._dname, list(self)
+        )
+
+
+def load_dataset(dname, mmap_mode=None, writeable=False):
+    if not fname_is_path(dname):
+        raise TypeError("datasets must be directories, not file-like objects")
+    if not os.path.isdir(dname):
+        raise FileNotFoundError("dataset directory {} not found".format(dname))
+    return DatasetBunch(dname, mmap_mode=mmap_mode, writeable=writeable)
+
+
+def write_dataset(dname, fdict, mode="w", max_workers=None):
+    """
+    Write the top-level keys of fdict as separate files, in parallel.
+
+    mode="w" removes any keys in the directory not present in fdict, while
+    mode="a" only (re)writes the keys given, leaving the others untouched.
+    """
+    if mode not in ("w", "a"):
+        raise ValueError("mode must be 'w' or 'a'")
+    if not fname_is_path(dname):
+        raise TypeError("datasets must be directories, not file-like objects")
+    for key in fdict:
+        _key_check(key)
+    os.makedirs(dname, exist_ok=True)
+
+    if mode == "w":
+        for key in _key_files(dname):
+            if key not in fdict:
+                delete_key(dname, key)
+
+    items = [(k, v) for k, v in fdict.items() if v is not None]
+    if max_workers == 1 or len(items) <= 1:
+        for key, value in items:
+            write_key(dname, key, value)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(write_key, dname, k, v) for k, v in items]
+            for future in futures:
+                # raise any exceptions
+                future.result()
+    return
@@ -7,14 +7,14 @@
 # with details inline in source files, comments, and docstrings.
 """
 """
+from .utilities import read_text
 
 
 def ini_load(fname):
     import configparser
 
     dummy_section = "dummy_section"
-    with open(fname) as f:
-        file_content = "[{}]\n".format(dummy_section) + f.read()
+    file_content = "[{}]\n".format(dummy_section) + read_text(fname)
 
     cp = configparser.ConfigParser(interpolation=None)
     cp.read_string(file_content)
@@ -23,11 +23,13 @@ def ini_load(fname):
         base[op] = cp.get(dummy_section, op)
     sections = dict()
     for sec in cp.sections():
+        if sec == dummy_section:
+            continue
         d = dict()
         sections[sec] = d
         for op in cp.options(sec):
             d[op] = cp.get(sec, op)
-    if set(base.keys()) ^ set(sections.keys()):
+    if set(base.keys()) & set(sections.keys()):
         raise RuntimeError(
             ("ini file {} has setting which conflicts with section name").format(fname)
         )
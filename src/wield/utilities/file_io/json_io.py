@@ -10,15 +10,22 @@
 import json
 import sys
 
+from .utilities import fname_is_path, read_text, write_text
+
 
 def load_json(fname):
-    with open(fname) as F:
-        fdict = json.load(F)
+    if fname_is_path(fname):
+        with open(fname) as F:
+            fdict = json.load(F)
+    else:
+        fdict = json.loads(read_text(fname))
     return fdict
 
 
 def write_json(fname, fdict):
-    if sys.version_info < (3, 4):
+    if not fname_is_path(fname):
+        write_text(fname, json.dumps(fdict, indent=4, ensure_ascii=False))
+    elif sys.version_info < (3, 4):
         with open(fname, "w") as F:
             json.dump(fdict, F, indent=4, ensure_ascii=False)
     else:
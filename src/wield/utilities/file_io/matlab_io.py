@@ -9,6 +9,8 @@
 """
 import numpy as np
 
+from .utilities import fname_as_fileobj
+
 
 def squeezerec(key, obj):
     if isinstance(obj, dict):
@@ -43,7 +45,7 @@ def load_matlab(fname):
 
     d = dict()
     d = scipy.io.loadmat(
-        fname,
+        fname_as_fileobj(fname),
         mdict=d,
         squeeze_me=True,
         chars_as_strings=True,
@@ -9,14 +9,20 @@
 """
 import pickle
 
+from .utilities import fname_is_path, fname_as_fileobj
+
 
 def load_pickle(fname):
+    if not fname_is_path(fname):
+        return pickle.load(fname_as_fileobj(fname))
     with open(fname, "rb") as F:
         fdict = pickle.load(F)
     return fdict
 
 
 def write_pickle(fname, fdict):
+    if not fname_is_path(fname):
+        return pickle.dump(fdict, fname)
     with open(fname, "wb") as F:
         fdict = pickle.dump(fdict, F)
     return fdict
@@ -29,6 +29,7 @@ ext2type = {
     ".csv": "csv",
     ".txt.gz": "csv",
     ".csv.bz2": "csv",
+    ".dataset": "dataset",
 }
 
 
@@ -46,6 +47,8 @@ type2type = {
     "csv": "csv",
     "pkl": "pickle",
     "pickle": "pickle",
+    "dataset": "dataset",
+    "dir": "dataset",
     "special": "special",
 }
 
@@ -100,12 +103,35 @@ type2features = {
         complex=True,
         ndarray=True,
     ),
+    # directory with one file per top-level key, see dataset_io
+    "dataset": dict(
+        data=True,
+        config=False,
+        compact=True,
+        complex=True,
+        ndarray=True,
+    ),
 }
 
 re_FILEKEY = re.compile(r"(.*)\[(.*)\]$")
 
 
 def determine_type(fname):
+    """
+    Split a file specification of the form "fname[subkey]::ftype" into a
+    Bunch of fname, subkey and ftype. File-like objects and bytes-like buffers
+    are passed through with ftype=None, as their type cannot be inferred and
+    must be given explicitly.
+    """
+    if isinstance(fname, os.PathLike):
+        fname = os.fspath(fname)
+    if not isinstance(fname, str):
+        return Bunch(
+            fname=fname,
+            subkey=None,
+            ftype=None,
+        )
+
     fspl = fname.split("::")
 
     if len(fspl) == 1:
@@ -116,7 +142,8 @@ def determine_type(fname):
             subkey = m.group(2)
         else:
             subkey = None
-        fbase, fext = os.path.splitext(fname)
+        # directories such as datasets may be given with a trailing separator
+        fbase, fext = os.path.splitext(fname.rstrip("/" + os.sep))
         if fname[0] == ":" and fname[-1] == ":":
             ftype = "special"
             fname = fname[1:-1]
@@ -124,6 +151,7 @@ def determine_type(fname):
             ftype = ext2type[fext.lower()]
     elif len(fspl) == 2:
         fname, ftype = fspl
+        m = re_FILEKEY.match(fname)
         if m:
             fname = m.group(1)
             subkey = m.group(2)
@@ -7,6 +7,8 @@
 # with details inline in source files, comments, and docstrings.
 """
 """
+import io
+import os
 import collections
 import numpy as np
 import collections
@@ -18,6 +20,102 @@ _NOARG = lambda: _NOARG
 NOARG = ("NOARG", _NOARG)
 
 
+def fname_is_path(fname):
+    """
+    True if fname names a file on the filesystem, False for file-like objects
+    and bytes-like buffers.
+    """
+    return isinstance(fname, (str, os.PathLike))
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Seekable, read-only stream over a bytes-like object (bytes, bytearray,
+    memoryview, mmap, ndarray). Reads copy directly out of the buffer, so the
+    data is not duplicated as it would be with io.BytesIO(memoryview).
+    """
+
+    def __init__(self, buf):
+        self._buf = memoryview(buf).cast("B")
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        N = min(len(b), len(self._buf) - self._pos)
+        if N <= 0:
+            return 0
+        memoryview(b).cast("B")[:N] = self._buf[self._pos : self._pos + N]
+        self._pos += N
+        return N
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = len(self._buf) + offset
+        else:
+            raise ValueError("invalid whence ({})".format(whence))
+        if pos < 0:
+            raise ValueError("negative seek position {}".format(pos))
+        self._pos = pos
+        return pos
+
+    def tell(self):
+        return self._pos
+
+
+def fname_as_fileobj(fname):
+    """
+    Wrap bytes-like buffers as a file object, filenames and file-like objects
+    pass through.
+    """
+    if fname_is_path(fname):
+        return fname
+    if isinstance(fname, (bytes, bytearray, memoryview)):
+        return BufferReader(fname)
+    if not hasattr(fname, "read") and not hasattr(fname, "write"):
+        try:
+            return BufferReader(fname)
+        except TypeError:
+            raise TypeError(
+                "{} is not a filename, file-like object or buffer".format(type(fname))
+            )
+    return fname
+
+
+def read_text(fname, encoding="utf8"):
+    """
+    Read the full text from a filename, file-like object (text or binary)
+    or bytes-like buffer.
+    """
+    if fname_is_path(fname):
+        with open(fname, "r", encoding=encoding) as F:
+            return F.read()
+    text = fname_as_fileobj(fname).read()
+    if not isinstance(text, str):
+        text = bytes(text).decode(encoding)
+    return text
+
+
+def write_text(F, text, encoding="utf8"):
+    """
+    Write text into a file-like object, encoding it if the object is binary.
+    """
+    if isinstance(F, io.TextIOBase):
+        F.write(text)
+    elif "b" in getattr(F, "mode", "b"):
+        F.write(text.encode(encoding))
+    else:
+        F.write(text)
+
+
 def subkey_search(fdict, subkey, default=NOARG):
     if subkey is None:
         return fdict
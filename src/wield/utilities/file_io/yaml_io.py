@@ -12,6 +12,8 @@ import sys
 import re
 import yaml
 
+from .utilities import fname_is_path, read_text, write_text
+
 
 def yaml_load(fname):
     # HACK: fix loading number in scientific notation
@@ -37,8 +39,11 @@ def yaml_load(fname):
         list("-+0123456789."),
     )
 
-    with open(fname, "r") as F:
-        fdict = yaml.load(F, Loader=yaml_loader)
+    if fname_is_path(fname):
+        with open(fname, "r") as F:
+            fdict = yaml.load(F, Loader=yaml_loader)
+    else:
+        fdict = yaml.load(read_text(fname), Loader=yaml_loader)
     return fdict
 
 
@@ -50,7 +55,9 @@ yaml.SafeDumper.add_representer(collections.OrderedDict, dict_representer)
 
 
 def yaml_write(fname, fdict):
-    if sys.version_info < (3, 4):
+    if not fname_is_path(fname):
+        write_text(fname, yaml.safe_dump(fdict, default_flow_style=None))
+    elif sys.version_info < (3, 4):
         with open(fname, "w") as F:
             yaml.safe_dump(fdict, F, default_flow_style=None)
     else:
@@ -0,0 +1,500 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@caltech.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+Memoization of expensive array functions, keyed by the content of their
+arguments, with an in-memory LRU tier and an optional on-disk tier that
+persists across runs.
+
+    @memoize(cache_dir="~/.cache/my_results")
+    def unwrapped(data):
+        ...
+
+    unwrapped.memo.stats  # hits_memory, hits_disk, misses, ...
+    unwrapped.memo.clear()
+"""
+import os
+import re
+import json
+import zipfile
+import hashlib
+import tempfile
+import threading
+import functools
+import collections
+from collections import abc
+import numpy as np
+from wield.bunch import Bunch
+
+
+def _hash_update(h, obj):
+    """
+    Feed a type-tagged encoding of obj into the hash h. Arrays are hashed by
+    dtype, shape and buffer content. Raises TypeError for objects whose
+    content cannot be hashed reliably.
+    """
+    if obj is None or isinstance(obj, (bool, int, float, complex, str)):
+        h.update("{}:{!r};".format(type(obj).__name__, obj).encode("utf-8"))
+    elif isinstance(obj, bytes):
+        h.update(b"bytes:%d;" % len(obj))
+        h.update(obj)
+    elif isinstance(obj, (np.ndarray, np.generic)):
+        arr = np.asarray(obj)
+        if arr.dtype.hasobject:
+            raise TypeError("object arrays cannot be hashed by content")
+        h.update("ndarray:{}:{};".format(arr.dtype.str, arr.shape).encode("utf-8"))
+        h.update(memoryview(np.ascontiguousarray(arr)).cast("B"))
+    elif isinstance(obj, (tuple, list)):
+        h.update("{}:{};".format(type(obj).__name__, len(obj)).encode("utf-8"))
+        for v in obj:
+            _hash_update(h, v)
+    elif isinstance(obj, abc.Mapping):
+        h.update("mapping:{};".format(len(obj)).encode("utf-8"))
+        for k in sorted(obj, key=repr):
+            _hash_update(h, k)
+            _hash_update(h, obj[k])
+    else:
+        raise TypeError("cannot hash arguments of type {}".format(type(obj)))
+
+
+def content_hash(*args, **kwargs):
+    """
+    Hex digest of the content of args and kwargs, with numpy arrays hashed by
+    their buffer contents rather than identity.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    _hash_update(h, args)
+    _hash_update(h, kwargs)
+    return h.hexdigest()
+
+
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    elif isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    elif isinstance(value, abc.Mapping):
+        return sum(_nbytes(v) for v in value.values())
+    return 64
+
+
+def _arrays_in(obj, arrays):
+    """
+    Collect the arrays within the arguments obj into the list arrays
+    """
+    if isinstance(obj, np.ndarray):
+        arrays.append(obj)
+    elif isinstance(obj, (tuple, list)):
+        for v in obj:
+            _arrays_in(v, arrays)
+    elif isinstance(obj, abc.Mapping):
+        for v in obj.values():
+            _arrays_in(v, arrays)
+    return arrays
+
+
+def _freeze(value, inputs=()):
+    """
+    Mark the arrays of a result read-only, as they are shared by every hit.
+    Arrays sharing memory with the input arrays are copied first, so that the
+    caller's inputs are left writeable and later changes to them don't alter
+    the cached result. Tuples, lists, dicts and Bunches are rebuilt rather
+    than modified, as they may also be inputs.
+    """
+    if isinstance(value, np.ndarray):
+        if any(np.may_share_memory(value, a) for a in inputs):
+            value = value.copy()
+        value.flags.writeable = False
+        return value
+    elif type(value) in (tuple, list):
+        return type(value)(_freeze(v, inputs) for v in value)
+    elif type(value) in (dict, Bunch):
+        return type(value)({k: _freeze(v, inputs) for k, v in value.items()})
+    return value
+
+
+_python_scalars = (bool, int, float, str, type(None))
+
+
+def _encode(value, arrays, array_ok):
+    """
+    Encode value as a JSON-able spec, appending its arrays to the list arrays.
+    Only values which are decoded exactly as the same types are accepted:
+    arrays and numpy scalars with dtypes passing array_ok, python scalars,
+    str, bytes and None, tuples, lists and dicts or Bunches with str keys.
+    Raises TypeError for anything else.
+    """
+    if type(value) in _python_scalars:
+        return {"t": "py", "v": value}
+    elif type(value) is complex:
+        return {"t": "complex", "v": [value.real, value.imag]}
+    elif type(value) is bytes:
+        arrays.append(np.frombuffer(value, dtype=np.uint8))
+        return {"t": "bytes", "i": len(arrays) - 1}
+    elif type(value) is np.ndarray or isinstance(value, np.generic):
+        arr = np.asarray(value)
+        if not array_ok(arr.dtype):
+            raise TypeError("arrays of dtype {} are not stored".format(arr.dtype))
+        arrays.append(arr)
+        tag = "ndarray" if type(value) is np.ndarray else "generic"
+        return {"t": tag, "i": len(arrays) - 1, "shape": list(arr.shape)}
+    elif type(value) in (tuple, list):
+        return {
+            "t": type(value).__name__,
+            "v": [_encode(v, arrays, array_ok) for v in value],
+        }
+    elif type(value) in (dict, Bunch):
+        if not all(type(k) is str for k in value.keys()):
+            raise TypeError("only mappings with str keys are stored")
+        return {
+            "t": type(value).__name__,
+            "k": list(value.keys()),
+            "v": [_encode(v, arrays, array_ok) for v in value.values()],
+        }
+    raise TypeError("results of type {} are not stored".format(type(value)))
+
+
+def _decode(spec, arrays):
+    t = spec["t"]
+    if t == "py":
+        return spec["v"]
+    elif t == "complex":
+        return complex(*spec["v"])
+    elif t == "bytes":
+        return np.asarray(arrays[spec["i"]]).tobytes()
+    elif t in ("ndarray", "generic"):
+        arr = np.asarray(arrays[spec["i"]]).reshape(spec["shape"])
+        return arr if t == "ndarray" else arr[()]
+    elif t == "tuple":
+        return tuple(_decode(v, arrays) for v in spec["v"])
+    elif t == "list":
+        return [_decode(v, arrays) for v in spec["v"]]
+    elif t in ("dict", "Bunch"):
+        d = {k: _decode(v, arrays) for k, v in zip(spec["k"], spec["v"])}
+        return d if t == "dict" else Bunch(d)
+    raise ValueError("unknown spec type {}".format(t))
+
+
+def _spec_array(spec):
+    return np.frombuffer(json.dumps(spec).encode("ascii"), dtype=np.uint8)
+
+
+def _spec_load(arr):
+    return json.loads(np.asarray(arr).tobytes().decode("ascii"))
+
+
+def _npz_array_ok(dtype):
+    return not dtype.hasobject
+
+
+def _npz_write(fname, spec, arrays):
+    arrays = {"arr_{}".format(idx): arr for idx, arr in enumerate(arrays)}
+    with open(fname, "wb") as F:
+        np.savez(F, __spec__=_spec_array(spec), **arrays)
+
+
+def _npz_read(fname):
+    with np.load(fname, allow_pickle=False) as npz:
+        spec = _spec_load(npz["__spec__"])
+        N = len([k for k in npz.files if k.startswith("arr_")])
+        arrays = [npz["arr_{}".format(idx)] for idx in range(N)]
+    return spec, arrays
+
+
+def _hdf5_array_ok(dtype):
+    # the numeric dtypes which file_io stores and loads exactly
+    return dtype.kind in "biufc"
+
+
+def _hdf5_write(fname, spec, arrays):
+    from . import file_io
+
+    # file_io returns 0-d arrays as python scalars, the shapes are in the spec
+    arrays = {"arr_{}".format(idx): arr.reshape(-1) for idx, arr in enumerate(arrays)}
+    file_io.save(fname, {"spec": _spec_array(spec), "arrays": arrays}, ftype="hdf5")
+
+
+def _hdf5_read(fname):
+    from . import file_io
+
+    fdict = file_io.load(fname, ftype="hdf5")
+    try:
+        spec = _spec_load(fdict["spec"])
+        stored = fdict.get("arrays", dict())
+        arrays = [
+            np.asarray(stored["arr_{}".format(idx)]) for idx in range(len(stored))
+        ]
+    finally:
+        fdict.hdf.file.close()
+    return spec, arrays
+
+
+# name -> (extension, array_ok, write, read)
+backends = {
+    "npz": (".npz", _npz_array_ok, _npz_write, _npz_read),
+    "hdf5": (".h5", _hdf5_array_ok, _hdf5_write, _hdf5_read),
+}
+
+
+# names of the files written by Memoizer, (prefix, key, extension)
+_fname_re = re.compile(
+    r"^([\w.]+)-([0-9a-f]{{40}})({})$".format(
+        "|".join(re.escape(v[0]) for v in backends.values())
+    )
+)
+
+
+class Memoizer(object):
+    """
+    The cache behind a memoized function. Results are looked up in the
+    memory tier, an LRU of at most memory_items results and memory_bytes of
+    arrays, then in the disk tier under cache_dir (if given). Disk files are
+    evicted least recently used first once the memoized files in cache_dir
+    total more than disk_bytes. Files are named after the qualified name of
+    func and the key, and other files in cache_dir are never touched.
+
+    stats counts hits_memory, hits_disk, misses, uncached calls (whose
+    arguments cannot be hashed) and evictions from disk.
+    """
+
+    def __init__(
+        self,
+        func,
+        cache_dir=None,
+        backend="npz",
+        memory_items=128,
+        memory_bytes=2**28,
+        disk_bytes=2**30,
+        version=None,
+    ):
+        if backend not in backends:
+            raise ValueError("backend must be one of {}".format(list(backends)))
+        self.func = func
+        self.name = "{}.{}".format(func.__module__, func.__qualname__)
+        self.version = version
+        self.backend = backend
+        self.memory_items = memory_items
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        if cache_dir is not None:
+            cache_dir = os.path.expanduser(os.fspath(cache_dir))
+            os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        # the qualified name keeps functions of the same name in different
+        # modules apart, characters unsafe in file names are replaced
+        self._prefix = re.sub(r"[^\w.]", "_", self.name)
+
+        self._memory = collections.OrderedDict()
+        self._memory_nbytes = 0
+        self._lock = threading.Lock()
+        self.stats = Bunch(
+            hits_memory=0,
+            hits_disk=0,
+            misses=0,
+            uncached=0,
+            evictions=0,
+        )
+
+    def key(self, args, kwargs):
+        return content_hash(self.name, self.version, args, kwargs)
+
+    def _fpath(self, key):
+        ext = backends[self.backend][0]
+        fname = "{}-{}{}".format(self._prefix, key, ext)
+        return os.path.join(self.cache_dir, fname)
+
+    def _memory_put(self, key, value):
+        nbytes = _nbytes(value)
+        if nbytes > self.memory_bytes or self.memory_items < 1:
+            return
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = (value, nbytes)
+            self._memory_nbytes += nbytes
+            while (
+                len(self._memory) > self.memory_items
+                or self._memory_nbytes > self.memory_bytes
+            ):
+                _, (_, old_nbytes) = self._memory.popitem(last=False)
+                self._memory_nbytes -= old_nbytes
+
+    def _disk_get(self, key):
+        fpath = self._fpath(key)
+        read = backends[self.backend][3]
+        try:
+            spec, arrays = read(fpath)
+        except FileNotFoundError:
+            return None, False
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            # unreadable or partial files from an interrupted run are dropped
+            # and recomputed
+            try:
+                os.remove(fpath)
+            except OSError:
+                pass
+            return None, False
+        value = _decode(spec, arrays)
+        try:
+            # marks the file as recently used for the eviction
+            os.utime(fpath)
+        except OSError:
+            pass
+        return value, True
+
+    def _disk_put(self, key, value):
+        ext, array_ok, write, _ = backends[self.backend]
+        arrays = []
+        try:
+            spec = _encode(value, arrays, array_ok)
+        except TypeError:
+            # results the backend cannot store exactly stay in the memory
+            # tier only
+            return
+        fpath = self._fpath(key)
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp-", suffix=ext)
+        os.close(fd)
+        try:
+            # the spec and the list of (read-only) arrays are new containers,
+            # so the backend never modifies the result held by the caller
+            write(tmp, spec, arrays)
+            os.replace(tmp, fpath)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self._evict()
+
+    def _evict(self):
+        """
+        Remove the least recently used files until the total is within
+        disk_bytes
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if _fname_re.match(entry.name) is None or not entry.is_file():
+                continue
+            st = entry.stat()
+            entries.append((st.st_mtime_ns, st.st_size, entry.path))
+            total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            self.stats.evictions += 1
+
+    def __call__(self, *args, **kwargs):
+        try:
+            key = self.key(args, kwargs)
+        except TypeError:
+            self.stats.uncached += 1
+            return self.func(*args, **kwargs)
+
+        with self._lock:
+            entry = self._memory.get(key, None)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.stats.hits_memory += 1
+                return entry[0]
+
+        if self.cache_dir is not None:
+            value, found = self._disk_get(key)
+            if found:
+                self.stats.hits_disk += 1
+                value = _freeze(value)
+                self._memory_put(key, value)
+                return value
+
+        self.stats.misses += 1
+        value = _freeze(self.func(*args, **kwargs), _arrays_in((args, kwargs), []))
+        self._memory_put(key, value)
+        if self.cache_dir is not None:
+            self._disk_put(key, value)
+        return value
+
+    def clear(self, memory=True, disk=True):
+        """
+        Empty the memory tier and remove this function's files from the disk
+        tier
+        """
+        if memory:
+            with self._lock:
+                self._memory.clear()
+                self._memory_nbytes = 0
+        if disk and self.cache_dir is not None:
+            for entry in os.scandir(self.cache_dir):
+                m = _fname_re.match(entry.name)
+                if m is None or m.group(1) != self._prefix:
+                    continue
+                if m.group(3) != backends[self.backend][0] or not entry.is_file():
+                    continue
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+
+def memoize(
+    func=None,
+    cache_dir=None,
+    backend="npz",
+    memory_items=128,
+    memory_bytes=2**28,
+    disk_bytes=2**30,
+    version=None,
+):
+    """
+    Decorator memoizing func by the content of its arguments (see
+    content_hash), which may be numpy arrays, scalars, strings and nested
+    tuples, lists and dicts of them. Calls with other arguments are passed
+    through uncached.
+
+    Results are kept in memory, and with cache_dir also stored on disk using
+    backend, "npz" or "hdf5" (through file_io). Results are stored as nested
+    tuples, lists, dicts and Bunches of arrays, numpy scalars, python
+    scalars, str and bytes, and load as the same types. hdf5 only stores
+    numeric arrays. Results the backend cannot store exactly are only kept in
+    memory. Change version to invalidate the stored results of a modified
+    function. The returned arrays are shared between calls and so are
+    read-only, arrays sharing memory with the arguments are copied first.
+
+    The Memoizer is available as the .memo attribute of the wrapped
+    function, for its stats and clear(). May be used as @memoize or with
+    arguments as @memoize(cache_dir=...).
+    """
+    if func is None:
+        return functools.partial(
+            memoize,
+            cache_dir=cache_dir,
+            backend=backend,
+            memory_items=memory_items,
+            memory_bytes=memory_bytes,
+            disk_bytes=disk_bytes,
+            version=version,
+        )
+
+    memo = Memoizer(
+        func,
+        cache_dir=cache_dir,
+        backend=backend,
+        memory_items=memory_items,
+        memory_bytes=memory_bytes,
+        disk_bytes=disk_bytes,
+        version=version,
+    )
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return memo(*args, **kwargs)
+
+    wrapper.memo = memo
+    return wrapper
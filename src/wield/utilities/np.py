@@ -7,14 +7,168 @@
 # with details inline in source files, comments, and docstrings.
 """
 """
+import os
 import numpy as np
-import cmath
-from functools import reduce
+import itertools
+from collections import abc
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# global parallel backend settings, see set_num_threads
+_num_threads = 1
+_thread_pool = None
+_thread_pool_size = 0
+_thread_pool_lock = threading.Lock()
+# below this number of elements, work is not split across threads
+parallel_min_size = 2**16
+
+
+def set_num_threads(num_threads=None):
+    """
+    Set the number of threads used by the parallel backend of the array
+    helpers (continuous_phase, group_delay, matrix_stack, vector_stack,
+    generate_sections_array and batched_inv/solve/det) and by
+    file_io.hdf5_io.write_hdf5_parallel. None uses all cores. The default of
+    1 runs everything in the calling thread. Returns the previous setting.
+
+    The work is split into chunks along the leading axis and run in a shared
+    thread pool. NumPy releases the GIL within its kernels, so the chunks
+    run concurrently. A larger per-call num_threads grows the pool to match.
+    """
+    global _num_threads, _thread_pool
+    if num_threads is None:
+        num_threads = os.cpu_count() or 1
+    num_threads = int(num_threads)
+    if num_threads < 1:
+        raise ValueError("num_threads must be at least 1")
+    with _thread_pool_lock:
+        prev = _num_threads
+        _num_threads = num_threads
+        if _thread_pool is not None:
+            _thread_pool.shutdown(wait=False)
+            _thread_pool = None
+    return prev
+
+
+def get_num_threads():
+    return _num_threads
+
+
+def _get_thread_pool(num_threads=None):
+    """
+    The shared thread pool, with at least num_threads (default the global
+    setting) workers. A smaller pool is replaced by a larger one. The old
+    pool is not shut down, so calls still holding it finish, and its threads
+    exit once it is released.
+    """
+    global _thread_pool, _thread_pool_size
+    if num_threads is None:
+        num_threads = _num_threads
+    with _thread_pool_lock:
+        if _thread_pool is None or _thread_pool_size < num_threads:
+            _thread_pool_size = max(num_threads, _num_threads)
+            _thread_pool = ThreadPoolExecutor(_thread_pool_size)
+        return _thread_pool
+
+
+def parallel_threads(N, size, num_threads=None):
+    """
+    The number of threads to split work of N items along the leading axis
+    and size elements in total, 1 if it should not be split.
+    """
+    if num_threads is None:
+        num_threads = _num_threads
+    if size < parallel_min_size:
+        return 1
+    return max(1, min(num_threads, N))
+
+
+def parallel_slices(func, N, num_threads):
+    """
+    Call func(sl) for num_threads contiguous slices covering range(N) in the
+    shared thread pool, and wait for them. func typically fills its part of
+    a preallocated output.
+    """
+    if num_threads <= 1:
+        func(slice(0, N))
+        return
+    bounds = np.linspace(0, N, num_threads + 1).astype(int)
+    pool = _get_thread_pool(num_threads)
+    futures = [
+        pool.submit(func, slice(lo, hi)) for lo, hi in zip(bounds[:-1], bounds[1:])
+    ]
+    for future in futures:
+        future.result()
+
+
+# global precision policy, see set_precision
+_precision = None
+_precision_dtypes = {
+    "single": (np.dtype(np.float32), np.dtype(np.complex64)),
+    "double": (np.dtype(np.float64), np.dtype(np.complex128)),
+}
+
+
+def set_precision(precision):
+    """
+    Set the floating point precision policy of the array helpers
+    (matrix_stack, vector_stack and their StackPlan and BlockStack variants,
+    continuous_phase, mag_phase_signed, group_delay and logspaced). Each of them also takes a per-call precision
+    argument, which overrides this when not None.
+
+    None: the default, the dtypes follow the inputs as numpy would
+    "single": floating and complex data are computed and returned as
+      float32/complex64, halving the memory of double precision inputs
+    "double": floating and complex data are promoted to float64/complex128
+
+    Returns the previous setting.
+    """
+    global _precision
+    if precision is not None and precision not in _precision_dtypes:
+        raise ValueError("precision must be None, 'single' or 'double'")
+    prev = _precision
+    _precision = precision
+    return prev
+
+
+def get_precision():
+    return _precision
+
+
+def precision_dtype(dtype, precision=None):
+    """
+    The dtype to use for data of dtype under the precision policy. Integer,
+    boolean and other kinds are unchanged.
+    """
+    if precision is None:
+        precision = _precision
+    dtype = np.dtype(dtype)
+    if precision is None:
+        return dtype
+    try:
+        real, cplx = _precision_dtypes[precision]
+    except KeyError:
+        raise ValueError("precision must be None, 'single' or 'double'")
+    if dtype.kind == "f":
+        return real
+    elif dtype.kind == "c":
+        return cplx
+    return dtype
+
+
+def _as_precision(arr, precision):
+    """
+    arr as an array converted to the precision policy, without copying if it
+    already conforms.
+    """
+    arr = np.asarray(arr)
+    return arr.astype(precision_dtype(arr.dtype, precision), copy=False)
 
 
 def domain_sort(X, *Y):
     X = np.asarray(X)
-    if not np.all(X[:-1] <= X[1:]):
+    if not is_sorted(X):
         sort_idxs = np.argsort(X)
         X = X[sort_idxs]
         output = [X]
@@ -63,12 +217,102 @@ def select_through_none(select, *args):
     return aret
 
 
+def is_sorted(X):
+    X = np.asarray(X)
+    return bool(np.all(X[:-1] <= X[1:]))
+
+
+def _interval_select(X_min, X_max, X):
+    """
+    Returns a slice if X is 1-D and sorted, so that indexing gives views,
+    otherwise the indices of the points within [X_min, X_max] as given by
+    np.nonzero, which also serves N-D X.
+    """
+    if X.ndim != 1:
+        return np.nonzero((X >= X_min) & (X <= X_max))
+    if is_sorted(X):
+        idx_lo = np.searchsorted(X, X_min, side="left")
+        idx_hi = np.searchsorted(X, X_max, side="right")
+        return slice(idx_lo, max(idx_lo, idx_hi))
+    return np.flatnonzero((X >= X_min) & (X <= X_max))
+
+
 def interval_limit(X_min, X_max, X, *Y):
+    """
+    Limit X and the Y arrays to the points where X_min <= X <= X_max. If X
+    is 1-D and sorted, the returned arrays are views (slices) of the inputs
+    rather than copies. N-D X selects as np.where does, flattening the
+    selected points.
+    """
     X = np.asarray(X)
-    X_idx = np.where((X >= X_min) & (X <= X_max))
+    X_idx = _interval_select(X_min, X_max, X)
     return (X[X_idx],) + tuple(np.asarray(y)[X_idx] for y in Y)
 
 
+def _take_last(y, idx, out):
+    if isinstance(idx, slice):
+        if out is None:
+            return y[..., idx]
+        out[...] = y[..., idx]
+        return out
+    return np.take(y, idx, axis=-1, out=out)
+
+
+def _take_batch(Y, idx, out):
+    """
+    Apply the indices (or slice) idx along the last axis of the (K, N) block
+    Y, or of each array of the mapping Y. out, if given, is the matching
+    preallocated array or mapping of arrays.
+    """
+    if isinstance(Y, abc.Mapping):
+        if out is None:
+            out = dict()
+        ret = dict()
+        for k, y in Y.items():
+            if y is None:
+                ret[k] = None
+                continue
+            y = np.asarray(y)
+            if y.shape[-1:] == (1,):
+                ret[k] = y
+                continue
+            ret[k] = _take_last(y, idx, out.get(k, None))
+        return ret
+    return _take_last(np.asarray(Y), idx, out)
+
+
+def domain_sort_batch(X, Y, out=None):
+    """
+    Batched form of domain_sort for many arrays sharing one X. Y is either a
+    (K, N) (or (..., N)) block or a mapping of (..., N) arrays. The sorting
+    permutation is computed once and applied along the last axis with a
+    single take, into out (an array or mapping of arrays) if given.
+
+    Returns (X, Y). If X is already sorted, Y is returned unchanged, or
+    copied into out if given.
+    """
+    X = np.asarray(X)
+    if is_sorted(X):
+        if out is None:
+            return X, Y
+        return X, _take_batch(Y, slice(None), out)
+    sort_idxs = np.argsort(X)
+    return X[sort_idxs], _take_batch(Y, sort_idxs, out)
+
+
+def interval_limit_batch(X_min, X_max, X, Y, out=None):
+    """
+    Batched form of interval_limit, with Y and out as in domain_sort_batch.
+    For sorted X, the interval is found with searchsorted and the results
+    are views into X and Y unless out is given.
+
+    Returns (X, Y).
+    """
+    X = np.asarray(X)
+    X_idx = _interval_select(X_min, X_max, X)
+    return X[X_idx], _take_batch(Y, X_idx, out)
+
+
 def masked_argsort(m_array):
     """
     Runs argsort on a masked array and only returns the argsort of the unmasked items
@@ -76,80 +320,243 @@ def masked_argsort(m_array):
     return np.argsort(m_array)[: sum(~m_array.mask)]
 
 
-def continuous_phase(data, op_idx=0, sep=(1.01) * np.pi, deg=False, shiftmod=2):
-    raw_angle = np.angle(data)
-    diff = np.diff(raw_angle)
+def continuous_phase(
+    data,
+    op_idx=0,
+    sep=(1.01) * np.pi,
+    deg=False,
+    shiftmod=2,
+    axis=-1,
+    num_threads=None,
+    precision=None,
+    center=True,
+):
+    """
+    Unwrap the phase of data along axis. Jumps larger than sep are treated
+    as wraps. The accumulated shift is kept modulo shiftmod turns (unless
+    shiftmod is None) and the result is referenced so that the phase at
+    op_idx is within [-pi, pi]. Finally, if center is True, the phase is
+    offset by a turn if it mostly sits below -pi/4.
+
+    data may be N-D, in which case every trace along axis is unwrapped
+    independently in a single vectorized call. Large stacks of traces are
+    split across num_threads threads (see set_num_threads). The phase is
+    computed in the precision of data or as set by precision (see
+    set_precision).
+    """
+    data = _as_precision(data, precision)
+    D = np.moveaxis(data, axis, -1)
+    threads = 1
+    if D.ndim > 1:
+        threads = parallel_threads(D.shape[0], D.size, num_threads)
+    if threads > 1:
+        out = np.empty(D.shape, dtype=np.angle(D.flat[:0]).dtype)
+
+        def run(sl):
+            out[sl] = continuous_phase(
+                D[sl],
+                op_idx=op_idx,
+                sep=sep,
+                deg=deg,
+                shiftmod=shiftmod,
+                axis=-1,
+                num_threads=1,
+                precision=precision,
+                center=center,
+            )
+
+        parallel_slices(run, D.shape[0], threads)
+        return np.moveaxis(out, -1, axis)
+
+    raw_angle = np.angle(D)
+    diff = np.diff(raw_angle, axis=-1)
     sep = abs(sep)
-    where_up = list(np.where(diff > sep)[0])
-    where_down = list(np.where(diff < -sep)[0])
-    value_mods = []
-    shift = 0
-
-    def shift_mod(val):
-        return ((shiftmod + val) % (2 * shiftmod)) - shiftmod
-
-    while True:
-        if where_up and where_down:
-            if where_up[-1] > where_down[-1]:
-                shift = shift_mod(shift - 1)
-                where = where_up.pop()
-            else:
-                shift = shift_mod(shift + 1)
-                where = where_down.pop()
-        elif where_up:
-            shift = shift_mod(shift - 1)
-            where = where_up.pop()
-        elif where_down:
-            shift = shift_mod(shift + 1)
-            where = where_down.pop()
-        else:
-            break
-        value_mods.append((where + 1, shift * 2 * np.pi))
-
-    if not value_mods:
-        if np.average(raw_angle) < -np.pi / 4:
-            raw_angle += np.pi * 2
-        if deg:
-            raw_angle *= 180.0 / np.pi
-        return raw_angle
-
-    full_shift = np.empty_like(raw_angle)
-    last_where, shift = value_mods.pop()
-    full_shift[0:last_where] = shift
-    while value_mods:
-        new_where, shift = value_mods.pop()
-        full_shift[last_where:new_where] = shift
-        last_where = new_where
-    full_shift[last_where:] = 0
-
-    raw_angle -= full_shift
-    raw_angle += full_shift[op_idx]
-    while raw_angle[op_idx] < -np.pi:
-        raw_angle += 2 * np.pi
-    while raw_angle[op_idx] > np.pi:
-        raw_angle -= 2 * np.pi
-
-    median = np.sort(raw_angle)[int(len(raw_angle) / 2)]
-    if median < -np.pi / 4:
-        raw_angle += np.pi * 2
+
+    # +1 at downward wraps, -1 at upward wraps. Each wrap shifts all of
+    # the points before it, so the shift is a reversed cumulative sum.
+    jumps = (diff < -sep).astype(np.int64) - (diff > sep)
+    has_wraps = np.any(jumps != 0, axis=-1)
+    shift = np.zeros(raw_angle.shape, dtype=np.int64)
+    np.cumsum(jumps[..., ::-1], axis=-1, out=shift[..., -2::-1])
+    # the modulus of the cumulative sum is identical to applying it per wrap
+    if shiftmod is not None:
+        shift = ((shiftmod + shift) % (2 * shiftmod)) - shiftmod
+    full_shift = (shift * (2 * np.pi)).astype(raw_angle.dtype, copy=False)
+
+    # the shift is referenced to op_idx, so the reference point keeps its
+    # raw angle
+    op_angle = raw_angle[..., op_idx]
+    raw_angle = raw_angle - full_shift
+    raw_angle += full_shift[..., op_idx : op_idx + 1 or None]
+
+    # bring the reference point into [-pi, pi], only for traces with wraps
+    n_turns = np.where(
+        op_angle < -np.pi,
+        np.ceil((-np.pi - op_angle) / (2 * np.pi)),
+        0,
+    ) - np.where(
+        op_angle > np.pi,
+        np.ceil((op_angle - np.pi) / (2 * np.pi)),
+        0,
+    )
+    n_turns = np.where(has_wraps, n_turns, 0)
+    raw_angle += (2 * np.pi * n_turns)[..., np.newaxis]
+
+    # traces with wraps test the median, those without test the average
+    N = raw_angle.shape[-1]
+    if N > 0 and center:
+        median = np.partition(raw_angle, N // 2, axis=-1)[..., N // 2]
+        average = np.average(raw_angle, axis=-1)
+        offset = np.where(has_wraps, median, average) < -np.pi / 4
+        raw_angle += (np.pi * 2 * offset)[..., np.newaxis]
 
     if deg:
         raw_angle *= 180.0 / np.pi
-    return raw_angle
+    return np.moveaxis(raw_angle, -1, axis)
 
 
-def logspaced(lower, upper, n_points):
+def logspaced(lower, upper, n_points, precision=None):
     """
-    Not very smart about preserving the number of points with a discontiguous interval set
+    Not very smart about preserving the number of points with a discontiguous interval set,
+    for that, use frequency_grid
+
+    precision "single" generates the points in float32, see set_precision.
     """
     log_lower = np.log(lower)
     log_upper = np.log(upper)
-    return np.exp(np.linspace(log_lower, log_upper, int(n_points)))
+    dtype = precision_dtype(np.result_type(log_lower, log_upper), precision)
+    return np.exp(np.linspace(log_lower, log_upper, int(n_points), dtype=dtype))
+
+
+def _merge_intervals(intervals):
+    """
+    Sort the (lower, upper) intervals, merge the overlapping ones and drop
+    those of zero width, which hold no points of their own
+    """
+    intervals = np.asarray(intervals, dtype=float).reshape(-1, 2)
+    if np.any(intervals[:, 0] <= 0) or np.any(intervals[:, 1] < intervals[:, 0]):
+        raise ValueError("intervals must satisfy 0 < lower <= upper")
+    intervals = intervals[np.argsort(intervals[:, 0])]
+    merged = [list(intervals[0])]
+    for lower, upper in intervals[1:]:
+        if lower <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], upper)
+        else:
+            merged.append([lower, upper])
+    merged = [(lower, upper) for lower, upper in merged if lower < upper]
+    if not merged:
+        raise ValueError("intervals must include one of nonzero width")
+    return tuple(merged)
+
+
+def _allocate_points(widths, n_points):
+    """
+    Split n_points among intervals proportional to widths, by largest
+    remainder, with at least 2 points (the end points) each.
+    """
+    widths = np.asarray(widths, dtype=float)
+    extra = n_points - 2 * len(widths)
+    if extra < 0:
+        raise ValueError("n_points must be at least 2 per interval")
+    total = np.sum(widths)
+    if total == 0:
+        quota = np.full(len(widths), extra / len(widths))
+    else:
+        quota = extra * widths / total
+    counts = np.floor(quota).astype(int)
+    remain = extra - np.sum(counts)
+    counts[np.argsort(counts - quota)[:remain]] += 1
+    return counts + 2
+
+
+@functools.lru_cache(maxsize=128)
+def _frequency_grid(intervals, n_points, refine, refine_width, refine_points):
+    log_intervals = np.log(np.asarray(intervals))
+    counts = _allocate_points(log_intervals[:, 1] - log_intervals[:, 0], n_points)
+    grids = []
+    for (lower, upper), count in zip(intervals, counts):
+        grid = logspaced(lower, upper, count)
+        # keep the end points exact
+        grid[0] = lower
+        grid[-1] = upper
+        grids.append(grid)
+    grid = np.unique(np.concatenate(grids))
+    if len(grid) < n_points:
+        raise ValueError(
+            "intervals are too narrow to hold {} distinct points".format(n_points)
+        )
+
+    grids = [grid]
+    log_width = refine_width * np.log(10)
+    for F_center in refine:
+        log_center = np.log(F_center)
+        for log_lower, log_upper in log_intervals:
+            lower = max(log_lower, log_center - log_width)
+            upper = min(log_upper, log_center + log_width)
+            if lower < upper:
+                grids.append(np.exp(np.linspace(lower, upper, refine_points)))
+
+    grid = np.unique(np.concatenate(grids))
+    grid.flags.writeable = False
+    return grid
+
+
+def frequency_grid(intervals, n_points, refine=(), refine_width=0.01, refine_points=20):
+    """
+    Log-spaced grid over one or more (lower, upper) intervals. Overlapping
+    intervals are merged and n_points are split among the intervals in
+    proportion to their width in log frequency, each including its end
+    points. This preserves the density of points across a discontiguous set
+    of intervals, unlike calling logspaced per interval.
+
+    Intervals of zero width (lower == upper) are dropped. Without refine, the
+    grid has exactly n_points distinct points, and a ValueError is raised if
+    the intervals are too narrow to resolve them in floating point.
+
+    refine is a list of frequencies (such as resonances) around which
+    refine_points additional log-spaced points are placed, spanning
+    refine_width decades to either side and limited to the intervals.
+
+    Grids are cached by their parameters, so the returned array is shared
+    and read-only. Copy it before modifying.
+    """
+    intervals = _merge_intervals(intervals)
+    refine = tuple(sorted(float(F) for F in np.ravel(refine)))
+    return _frequency_grid(
+        intervals, int(n_points), refine, float(refine_width), int(refine_points)
+    )
+
+
+def frequency_grid_cache_clear():
+    _frequency_grid.cache_clear()
 
 
 def common_type(nd_array):
-    nd_flat = np.asanyarray(nd_array).flatten()
-    return reduce(type_reduce, nd_flat, nd_flat[0].__class__)
+    """
+    The most general type of the elements of nd_array, such that every
+    element is an instance of it, or None if there is no such type among
+    the elements (or any element is None).
+
+    For non-object arrays this is the scalar type of the dtype. For object
+    arrays the distinct element types are collected in one pass and only
+    those are reduced, in order of first appearance.
+    """
+    nd_array = np.asanyarray(nd_array)
+    if nd_array.dtype != object:
+        return nd_array.dtype.type
+    nd_flat = nd_array.ravel()
+    types = iter(dict.fromkeys(map(type, nd_flat)))
+    type_A = next(types)
+    if type_A is type(None):
+        return None
+    for type_B in types:
+        if issubclass(type_B, type_A):
+            continue
+        elif issubclass(type_A, type_B):
+            type_A = type_B
+        else:
+            return None
+    return type_A
 
 
 def type_reduce(type_A, obj_B):
@@ -162,47 +569,488 @@ def type_reduce(type_A, obj_B):
     return None
 
 
-def argsort(array):
+def _numeric_for_sort(array):
+    """
+    array as a numeric ndarray if it can be sorted as one without changing
+    the order, otherwise None.
+    """
+    if isinstance(array, np.ndarray):
+        if array.ndim != 1:
+            return None
+        if array.dtype.kind in "biuf":
+            return array
+        if array.dtype != object:
+            return None
+        types = set(map(type, array))
+        if types <= {float, bool}:
+            return array.astype(float)
+        if types <= {int, bool}:
+            try:
+                return array.astype(np.int64)
+            except OverflowError:
+                return None
+        return None
+    elif isinstance(array, (list, tuple)):
+        return _numeric_for_sort(np.asarray(array, dtype=object))
+    return None
+
+
+def argsort(array, stable=True):
     """
     Highly efficient argsort for pure python, this is also good for
     arrays where you only want the sort in the first dimesion
+
+    Returns a list of indices, see argsort_array for the same sort returning
+    an integer array.
     """
-    return sorted(list(range(len(array))), key=array.__getitem__)
+    numeric = _numeric_for_sort(array)
+    if numeric is not None:
+        return np.argsort(numeric, kind="stable" if stable else "quicksort").tolist()
+    return sorted(range(len(array)), key=array.__getitem__)
+
 
+def argsort_array(array, stable=True):
+    """
+    argsort returning an integer array of the indices. 1-D numeric arrays,
+    and lists or object arrays holding only ints or only floats, are
+    dispatched to np.argsort. stable=True, as sorted() is, keeps equal
+    elements in their original order.
+    """
+    numeric = _numeric_for_sort(array)
+    if numeric is not None:
+        return np.argsort(numeric, kind="stable" if stable else "quicksort")
+    idxs = sorted(range(len(array)), key=array.__getitem__)
+    return np.asarray(idxs, dtype=np.intp)
+
+
+def mag_phase_signed(v, deg=True, out=None, precision=None):
+    """
+    Split v into a signed real magnitude and a phase restricted to
+    [-pi/4, 3pi/4), such that v = mag * exp(1j * ang).
+
+    This is elementwise, so v may have any shape. out may be a tuple of
+    preallocated (mag, ang) real arrays of the same shape, which are filled in
+    place to avoid the temporaries. precision sets the precision policy for
+    v, see set_precision.
+    """
+    v = _as_precision(v, precision)
+    if out is None:
+        mag_out, ang_out = None, None
+    else:
+        mag_out, ang_out = out
+
+    # identical to np.angle, but able to fill an output buffer
+    ang = np.asarray(np.arctan2(v.imag, v.real, out=ang_out))
+    ang += np.pi * 9.0 / 4
+    np.remainder(ang, np.pi, out=ang)
+    ang -= np.pi / 4.0
+
+    # the real part of v * exp(-1j * ang), without complex temporaries
+    mag = np.asarray(np.cos(ang, out=mag_out))
+    mag *= v.real
+    tmp = np.sin(ang)
+    tmp *= v.imag
+    mag += tmp
 
-def mag_phase_signed(v, deg=True):
-    ang = (np.angle(v, deg=False) + np.pi * 9.0 / 4) % np.pi - np.pi / 4.0
-    mag = v * np.exp(-1j * ang)
     if deg:
-        ang = 180 / np.pi * ang
-    return np.real(mag), ang
+        ang *= 180 / np.pi
+    if ang.ndim == 0 and out is None:
+        return mag[()], ang[()]
+    return mag, ang
+
 
+complex_convert_fields = ("mag", "db", "phase", "mag_signed", "phase_signed")
 
-def group_delay(F, data, mult=3e8):
-    dang = np.convolve([1, -1], np.angle(data), mode="valid")
-    dang[dang > 1 * np.pi] -= 2 * np.pi
-    dang[dang < -1 * np.pi] += 2 * np.pi
-    dF = np.convolve([1, -1], F, mode="valid")
-    return F[-len(dang) :], mult * dang / dF
+
+def complex_convert(
+    v,
+    fields=("mag", "db", "phase"),
+    deg=False,
+    out=None,
+    chunk_size=2**13,
+    precision=None,
+):
+    """
+    Convert v into each of the representations in fields, in a single pass:
+      "mag": abs(v)
+      "db": 20 * log10(abs(v))
+      "phase": angle(v), in degrees if deg
+      "mag_signed", "phase_signed": as from mag_phase_signed(v, deg=deg)
+
+    v is processed in flat chunks of chunk_size elements, small enough for
+    the input, the squared magnitude temporary and the outputs to stay in
+    the L2 cache, rather than with a full-size temporary per numpy call.
+    The results are written into out, an optional mapping of preallocated
+    C-contiguous arrays keyed by field, and returned as a Bunch holding one
+    array per field. The precision of v can be set with precision (see
+    set_precision).
+    """
+    from wield.bunch import Bunch
+
+    v = _as_precision(v, precision)
+    for field in fields:
+        if field not in complex_convert_fields:
+            raise ValueError(
+                "field {} must be one of {}".format(field, complex_convert_fields)
+            )
+    is_complex = np.iscomplexobj(v)
+    dtype = np.result_type(v.real.dtype, np.float32)
+    if out is None:
+        out = dict()
+
+    result = Bunch()
+    flat = dict()
+    for field in fields:
+        arr = out.get(field, None)
+        if arr is None:
+            arr = np.empty(v.shape, dtype=dtype)
+        elif arr.shape != v.shape or not arr.flags.c_contiguous:
+            raise ValueError(
+                "out[{}] must be C-contiguous with the shape of v".format(field)
+            )
+        result[field] = arr
+        flat[field] = arr.reshape(-1)
+
+    v_flat = v.reshape(-1)
+    N = len(v_flat)
+    mag2_buf = np.empty(min(N, chunk_size), dtype=dtype)
+    tmp_buf = np.empty(min(N, chunk_size), dtype=dtype)
+    need_mag2 = "mag" in flat or "db" in flat
+    with np.errstate(divide="ignore"):
+        for start in range(0, N, chunk_size):
+            sl = slice(start, min(start + chunk_size, N))
+            n = sl.stop - sl.start
+            v_chunk = v_flat[sl]
+            re = v_chunk.real
+            im = v_chunk.imag if is_complex else 0
+
+            if need_mag2:
+                mag2 = np.multiply(re, re, out=mag2_buf[:n])
+                if is_complex:
+                    mag2 += np.multiply(im, im, out=tmp_buf[:n])
+                if "mag" in flat:
+                    np.sqrt(mag2, out=flat["mag"][sl])
+                if "db" in flat:
+                    db = np.log10(mag2, out=flat["db"][sl])
+                    db *= 10
+            if "phase" in flat:
+                phase = np.arctan2(im, re, out=flat["phase"][sl])
+                if deg:
+                    phase *= 180 / np.pi
+            if "mag_signed" in flat or "phase_signed" in flat:
+                mag_phase_signed(
+                    v_chunk,
+                    deg=deg,
+                    out=(
+                        flat["mag_signed"][sl] if "mag_signed" in flat else tmp_buf[:n],
+                        (
+                            flat["phase_signed"][sl]
+                            if "phase_signed" in flat
+                            else mag2_buf[:n]
+                        ),
+                    ),
+                )
+    return result
+
+
+def group_delay(F, data, mult=3e8, axis=-1, out=None, num_threads=None, precision=None):
+    """
+    Compute the group delay (scaled by mult) from the phase differences of data
+    along axis, returning the frequencies of the differences, F[1:], along
+    with the delay. data may be N-D, such as a stack of MIMO transfer
+    functions, with F either 1-D or broadcastable to data with the same
+    number of dimensions.
+
+    out may be a preallocated real array with the shape of data, but with one
+    fewer element along axis, to be filled in place. Large stacks are split
+    across num_threads threads (see set_num_threads).
+
+    The delay has the precision of data, or as set by precision (see
+    set_precision). F is used as given, as differences of single precision
+    frequencies lose accuracy quickly.
+    """
+    F = np.asarray(F)
+    data = _as_precision(data, precision)
+    D = np.moveaxis(data, axis, -1)
+    threads = 1
+    if D.ndim > 1:
+        threads = parallel_threads(D.shape[0], D.size, num_threads)
+    if threads > 1:
+        F_diff = F[1:]
+        if F.ndim > 1:
+            F = np.moveaxis(F, axis, -1)
+            F_diff = np.moveaxis(F[..., 1:], -1, axis)
+            F = np.broadcast_to(F, D.shape[:-1] + F.shape[-1:])
+        shape = D.shape[:-1] + (D.shape[-1] - 1,)
+        if out is None:
+            out = np.empty(shape, dtype=np.angle(D.flat[:0]).dtype)
+            O = out
+        else:
+            O = np.moveaxis(out, axis, -1)
+
+        def run(sl):
+            group_delay(
+                F[sl] if F.ndim > 1 else F,
+                D[sl],
+                mult=mult,
+                axis=-1,
+                out=O[sl],
+                num_threads=1,
+                precision=precision,
+            )
+
+        parallel_slices(run, D.shape[0], threads)
+        return F_diff, np.moveaxis(O, -1, axis)
+
+    ang = np.angle(D)
+    if out is None:
+        dang = np.subtract(ang[..., 1:], ang[..., :-1])
+    else:
+        dang = np.subtract(ang[..., 1:], ang[..., :-1], out=np.moveaxis(out, axis, -1))
+    np.subtract(dang, 2 * np.pi, out=dang, where=dang > 1 * np.pi)
+    np.add(dang, 2 * np.pi, out=dang, where=dang < -1 * np.pi)
+
+    if F.ndim <= 1:
+        F_diff = F[1:]
+        dF = F[1:] - F[:-1]
+    elif F.ndim != ang.ndim:
+        raise ValueError("F must be 1-D or have the same number of dimensions as data")
+    else:
+        F = np.moveaxis(F, axis, -1)
+        F_diff = np.moveaxis(F[..., 1:], -1, axis)
+        dF = F[..., 1:] - F[..., :-1]
+
+    dang *= mult
+    dang /= dF
+    return F_diff, np.moveaxis(dang, -1, axis)
+
+
+def _first_index(A, predicate, chunk_size, reverse=False):
+    """
+    Index of the first (or last, if reverse) element along the last axis of
+    A where predicate is True, scanning chunks of chunk_size so that
+    memmapped inputs are only read as far as needed. Returns -1 where there
+    is none. chunk_size may be an iterable of growing sizes.
+    """
+    N = A.shape[-1]
+    idx = np.full(A.shape[:-1], -1, dtype=np.intp)
+    pending = np.ones(A.shape[:-1], dtype=bool)
+    if isinstance(chunk_size, int):
+        chunk_size = itertools.repeat(chunk_size)
+    pos = 0
+    for size in chunk_size:
+        if pos >= N:
+            break
+        if reverse:
+            sl = slice(max(N - pos - size, 0), N - pos)
+        else:
+            sl = slice(pos, pos + size)
+        mask = predicate(A[..., sl])
+        found = pending & np.any(mask, axis=-1)
+        if reverse:
+            where = sl.stop - 1 - np.argmax(mask[..., ::-1], axis=-1)
+        else:
+            where = sl.start + np.argmax(mask, axis=-1)
+        idx[found] = where[found]
+        pending &= ~found
+        pos += size
+        if not np.any(pending):
+            break
+    return idx
+
+
+def _not_nan(v):
+    return ~np.isnan(v)
 
 
 def first_non_NaN(arr):
-    idx_lower = 0
-    idx_upper = len(arr)
-    N = 1
-    if not cmath.isnan(arr[0]):
-        return 0
-    while idx_lower + N < idx_upper:
-        if not cmath.isnan(arr[idx_lower + N]):
-            if N == 1:
-                return idx_lower + 1
+    """
+    Index of the first element of arr which is not NaN, or len(arr) if they
+    all are. Scans chunks of doubling size, so a short run of leading NaNs
+    only reads the start of arr.
+    """
+    arr = np.asanyarray(arr)
+    idx = _first_index(arr, _not_nan, (2**k for k in itertools.count(4)))
+    if idx < 0:
+        return len(arr)
+    return int(idx)
+
+
+def first_finite(arr, axis=-1, chunk_size=2**16):
+    """
+    Index of the first finite element along axis, or the length of the axis
+    where there is none. The axis is scanned in chunks of chunk_size, stopping
+    once every trace has been resolved, so memmapped arrays are read only as
+    far as needed.
+    """
+    arr = np.moveaxis(np.asanyarray(arr), axis, -1)
+    idx = _first_index(arr, np.isfinite, chunk_size)
+    idx = np.where(idx < 0, arr.shape[-1], idx)
+    return idx[()]
+
+
+def last_finite(arr, axis=-1, chunk_size=2**16):
+    """
+    Index of the last finite element along axis, or -1 where there is none.
+    Scans backward in chunks as first_finite.
+    """
+    arr = np.moveaxis(np.asanyarray(arr), axis, -1)
+    return _first_index(arr, np.isfinite, chunk_size, reverse=True)[()]
+
+
+def nan_sections(arr, chunk_size=2**24):
+    """
+    The runs of NaN in the 1-D array arr as an (M, 2) section array, see
+    generate_sections_array. arr is processed in chunks of chunk_size, so it
+    may be a memmap.
+    """
+    stream = SectionStream()
+    results = []
+    for idx in range(0, len(arr), chunk_size):
+        results.append(stream.update(np.isnan(arr[idx : idx + chunk_size])))
+    results.append(stream.finish())
+    return np.concatenate(results)
+
+
+def _nan_fill_block(Y, X, value):
+    """
+    Fill the NaNs along the last axis of the in-memory block Y, in place.
+    """
+    nan = np.isnan(Y)
+    if value is not None:
+        Y[nan] = value
+        return Y
+    if not np.any(nan):
+        return Y
+    N = Y.shape[-1]
+    arange = np.arange(N)
+    # index of the previous and next non-NaN points
+    prev = np.maximum.accumulate(np.where(nan, -1, arange), axis=-1)
+    nxt = np.where(nan, N, arange)[..., ::-1]
+    nxt = np.minimum.accumulate(nxt, axis=-1)[..., ::-1]
+    # hold the end values past the first and last non-NaN points
+    has_prev = prev >= 0
+    has_next = nxt < N
+    prev = np.where(has_prev, prev, nxt)
+    nxt = np.where(has_next, nxt, prev)
+    valid = (prev < N) & (nxt >= 0) & nan
+    prev = np.clip(prev, 0, N - 1)
+    nxt = np.clip(nxt, 0, N - 1)
+
+    y_prev = np.take_along_axis(Y, prev, axis=-1)
+    y_next = np.take_along_axis(Y, nxt, axis=-1)
+    x_prev = X[prev]
+    x_next = X[nxt]
+    span = x_next - x_prev
+    with np.errstate(invalid="ignore", divide="ignore"):
+        frac = np.where(span != 0, (X - x_prev) / span, 0)
+    Y[valid] = (y_prev + frac * (y_next - y_prev))[valid]
+    return Y
+
+
+def _nan_fill_run(O, X, idx_lo, idx_hi, left, right, block):
+    """
+    Fill O[idx_lo:idx_hi], a run of NaNs of the 1-D O, from the anchors left
+    and right, (x, y) of the neighboring non-NaN points or None, in blocks of
+    at most block points.
+    """
+    for idx in range(idx_lo, idx_hi, block):
+        sl = slice(idx, min(idx + block, idx_hi))
+        if left is not None and right is not None:
+            (x_prev, y_prev), (x_next, y_next) = left, right
+            span = x_next - x_prev
+            if span != 0:
+                frac = (X[sl] - x_prev) / span
             else:
-                idx_lower = idx_lower + N / 2
-                idx_upper = idx_lower + N
-                N = 1
+                frac = np.zeros(sl.stop - sl.start)
+            O[sl] = y_prev + frac * (y_next - y_prev)
+        elif left is not None:
+            O[sl] = left[1]
+        elif right is not None:
+            O[sl] = right[1]
         else:
-            N *= 2
-    return idx_upper
+            O[sl] = np.nan
+
+
+def _nan_fill_1d(A, O, X, value, block):
+    """
+    nan_fill of the 1-D A into O, reading block points at a time. The NaNs
+    after the last non-NaN point seen so far are only written once the next
+    one (or the end) is found, the previous non-NaN point is carried across
+    blocks as the left anchor.
+    """
+    N = A.shape[0]
+    left = None
+    # start of the run of NaNs not yet written
+    pending = None
+    for idx in range(0, N, block):
+        Y = np.array(A[idx : idx + block])
+        if value is not None:
+            O[idx : idx + block] = _nan_fill_block(Y, X, value)
+            continue
+        finite = np.flatnonzero(~np.isnan(Y))
+        if len(finite) == 0:
+            if pending is None:
+                pending = idx
+            continue
+        f_lo = finite[0]
+        f_hi = finite[-1] + 1
+        if pending is not None:
+            right = (X[idx + f_lo], Y[f_lo])
+            _nan_fill_run(O, X, pending, idx, left, right, block)
+        Xb = X[idx : idx + f_hi]
+        Yb = Y[:f_hi]
+        if left is not None:
+            # the carried anchor bounds the leading NaNs of this block
+            Xb = np.concatenate([[left[0]], Xb])
+            Yb = np.concatenate([[left[1]], Yb])
+            O[idx : idx + f_hi] = _nan_fill_block(Yb, Xb, None)[1:]
+        else:
+            O[idx : idx + f_hi] = _nan_fill_block(Yb, Xb, None)
+        left = (X[idx + f_hi - 1], Y[f_hi - 1])
+        pending = idx + f_hi if f_hi < len(Y) else None
+    if pending is not None:
+        _nan_fill_run(O, X, pending, N, left, None, block)
+
+
+def nan_fill(arr, value=None, X=None, axis=-1, out=None, chunk_bytes=2**24):
+    """
+    Replace the NaNs of arr. If value is given, they are set to it, otherwise
+    they are linearly interpolated along axis using the coordinates X (the
+    indices by default) from the neighboring non-NaN values, holding the end
+    values past the first and last of them. Traces which are all NaN are left
+    as NaN.
+
+    The result is written into out, which may be arr itself or a memmap.
+    Without out, a new in-memory array is returned, so pass out to keep the
+    memory use bounded for large inputs. Traces are processed in blocks of
+    about chunk_bytes, so arr may be a memmap as well. A single (1-D) trace
+    is read in blocks too, carrying the last non-NaN point across them.
+    """
+    arr = np.asanyarray(arr)
+    if out is None:
+        out = np.empty(arr.shape, dtype=arr.dtype)
+    elif out.shape != arr.shape:
+        raise ValueError("out must have the shape {}".format(arr.shape))
+    A = np.moveaxis(arr, axis, -1)
+    O = np.moveaxis(out, axis, -1)
+    N = A.shape[-1]
+    if X is None:
+        X = np.arange(N, dtype=float)
+    else:
+        X = np.asarray(X)
+        if X.shape != (N,):
+            raise ValueError("X must be 1-D with the length of axis")
+
+    if A.ndim == 1:
+        block = int(max(1, chunk_bytes // A.itemsize))
+        _nan_fill_1d(A, O, X, value, block)
+        return out
+    row_bytes = A.itemsize * N * int(np.prod(A.shape[1:-1], dtype=np.int64))
+    rows = int(max(1, chunk_bytes // max(row_bytes, 1)))
+    for idx in range(0, A.shape[0], rows):
+        O[idx : idx + rows] = _nan_fill_block(np.array(A[idx : idx + rows]), X, value)
+    return out
 
 
 def search_local_sorted_orig(arr_x, arr_y, val_x_start, val_y):
@@ -279,52 +1127,479 @@ def search_local_sorted(arr_x, arr_y, val_x_start, val_y):
     return frac_x, idx, sub_idx
 
 
+class Interpolator(object):
+    """
+    Linear interpolation from the sorted source grid X_src onto X_dst, with
+    the searchsorted indices and weights computed once. Calling it applies
+    them to Y arrays (real or complex, N-D with the source grid along axis)
+    in a single vectorized operation, so many Y sharing the same grids are
+    resampled without repeating np.interp.
+
+    x_log interpolates in log(X), as for log-spaced frequency grids.
+
+    mode sets how Y is interpolated:
+      "linear": Y directly
+      "polar": the magnitude, and the phase unwrapped along the source grid
+      "log": the log of the magnitude, and the unwrapped phase
+    For real Y, "polar" is the same as "linear" and "log" interpolates log(Y),
+    which must be positive.
+    The phase-aware modes avoid the magnitude dip from interpolating
+    complex values across a fast phase rotation. The unwrapping does not
+    cross wraps between source points, so the source grid must resolve the
+    phase.
+
+    Outside of the source grid the end values are held, as np.interp does,
+    unless left or right give fill values.
+    """
+
+    def __init__(self, X_src, X_dst, x_log=False, mode="linear", left=None, right=None):
+        if mode not in ("linear", "polar", "log"):
+            raise ValueError("mode must be 'linear', 'polar' or 'log'")
+        X_src = np.asarray(X_src)
+        X_dst = np.asarray(X_dst)
+        if X_src.ndim != 1 or len(X_src) < 2:
+            raise ValueError("X_src must be 1-D with at least 2 points")
+        if not is_sorted(X_src):
+            raise ValueError("X_src must be sorted, see domain_sort")
+        self.X_src = X_src
+        self.X_dst = X_dst
+        self.mode = mode
+        self.left = left
+        self.right = right
+
+        # found before any log, which fails for non-positive X_dst
+        self.below = X_dst < X_src[0]
+        self.above = X_dst > X_src[-1]
+        if x_log:
+            X_src = np.log(X_src)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                X_dst = np.log(X_dst)
+        idx = np.searchsorted(X_src, X_dst, side="right") - 1
+        idx = np.clip(idx, 0, len(X_src) - 2)
+        x_lo = X_src[idx]
+        span = X_src[idx + 1] - x_lo
+        with np.errstate(invalid="ignore", divide="ignore"):
+            weight = np.where(span != 0, (X_dst - x_lo) / span, 0)
+        # hold the end values outside of the source grid
+        idx[self.below] = 0
+        weight[self.below] = 0
+        weight[self.above] = 1
+        self.idx = idx
+        self.weight = weight
+
+    def _linear(self, Y, out):
+        # integer Y is interpolated in floating point, as np.interp does
+        dtype = np.result_type(Y, self.weight)
+        Y_lo = np.take(Y, self.idx, axis=-1).astype(dtype, copy=False)
+        Y_hi = np.take(Y, self.idx + 1, axis=-1).astype(dtype, copy=False)
+        Y_hi -= Y_lo
+        Y_hi *= self.weight
+        return np.add(Y_lo, Y_hi, out=out)
+
+    def _apply(self, Y, axis, out):
+        Y = np.moveaxis(np.asarray(Y), axis, -1)
+        if Y.shape[-1] != len(self.X_src):
+            raise ValueError("Y must have the length of X_src along axis")
+        O = None if out is None else np.moveaxis(out, axis, -1)
+
+        if self.mode == "linear" or not np.iscomplexobj(Y):
+            if self.mode == "log":
+                # real data must be positive
+                result = np.exp(self._linear(np.log(Y), None), out=O)
+            else:
+                result = self._linear(Y, O)
+        else:
+            mag = np.abs(Y)
+            if self.mode == "log":
+                with np.errstate(divide="ignore"):
+                    np.log(mag, out=mag)
+            mag = self._linear(mag, None)
+            if self.mode == "log":
+                np.exp(mag, out=mag)
+            phase = continuous_phase(Y, shiftmod=None, center=False)
+            phase = self._linear(phase, None)
+            # rebuilt as mag * exp(1j * phase), filling the parts in place
+            if O is None:
+                dtype = np.result_type(Y.dtype, self.weight.dtype)
+                O = np.empty(mag.shape, dtype=dtype)
+            np.multiply(np.cos(phase), mag, out=O.real)
+            np.multiply(np.sin(phase), mag, out=O.imag)
+            result = O
+
+        if self.left is not None:
+            result[..., self.below] = self.left
+        if self.right is not None:
+            result[..., self.above] = self.right
+        if out is not None:
+            return out
+        return np.moveaxis(result, -1, axis)
+
+    def __call__(self, Y, axis=-1, out=None):
+        """
+        Interpolate Y, or each array of the mapping Y, along axis. out may
+        be a preallocated array (or mapping of them) with the length of X_dst
+        along axis.
+        """
+        if isinstance(Y, abc.Mapping):
+            if out is None:
+                out = dict()
+            return {k: self._apply(y, axis, out.get(k, None)) for k, y in Y.items()}
+        return self._apply(Y, axis, out)
+
+
+class MonotoneSegmentIndex(object):
+    """
+    Precomputed monotone segments of the curve arr_x, arr_y for answering
+    many search_local_sorted style queries on the same curve. The segment
+    boundaries are found once, at the points where arr_y changes between
+    increasing and non-increasing. Each segment shares its end points with
+    its neighbors.
+
+    search takes arrays of (val_x_start, val_y) queries, finds the segment
+    containing val_x_start and locates val_y within it. Unlike
+    search_local_sorted, idx is always the non-negative index of the left
+    point of the interval containing the crossing.
+    """
+
+    def __init__(self, arr_x, arr_y):
+        self.arr_x = np.asarray(arr_x)
+        self.arr_y = np.asarray(arr_y)
+        N = len(self.arr_y)
+        if N < 2 or len(self.arr_x) != N:
+            raise ValueError("arr_x and arr_y must have the same length of at least 2")
+        increasing = self.arr_y[1:] > self.arr_y[:-1]
+        turns = np.flatnonzero(increasing[1:] != increasing[:-1]) + 1
+        # point indices of the segment boundaries
+        self.bounds = np.concatenate([[0], turns, [N - 1]]).astype(np.intp)
+        self.increasing = increasing[self.bounds[:-1]]
+
+    def segment(self, val_x_start):
+        """
+        Index of the segment containing each of val_x_start
+        """
+        idx_start = np.searchsorted(self.arr_x, val_x_start)
+        seg = np.searchsorted(self.bounds, idx_start, side="right") - 1
+        return np.clip(seg, 0, len(self.bounds) - 2)
+
+    def search(self, val_x_start, val_y):
+        """
+        Returns arrays of frac_x, idx, sub_idx with the broadcast shape of
+        val_x_start and val_y. The crossing lies between idx and idx + 1 at
+        the fraction sub_idx, which extrapolates (falls outside [0, 1]) if
+        val_y is beyond the range of the segment.
+        """
+        val_x_start, val_y = np.broadcast_arrays(val_x_start, val_y)
+        arr_x = self.arr_x
+        arr_y = self.arr_y
+        seg = self.segment(val_x_start)
+        sign = np.where(self.increasing[seg], 1, -1)
+        signed_val = sign * val_y
+
+        # vectorized bisection for the first point in each segment which is
+        # not below val_y (in the direction of the segment)
+        lo = self.bounds[seg]
+        hi = self.bounds[seg + 1] + 1
+        hi_last = hi - 1
+        active = lo < hi
+        while np.any(active):
+            mid = (lo + hi) // 2
+            mid_c = np.minimum(mid, hi_last)
+            below = sign * arr_y[mid_c] < signed_val
+            lo = np.where(active & below, mid + 1, lo)
+            hi = np.where(active & ~below, mid, hi)
+            active = lo < hi
+
+        idx = np.clip(lo - 1, self.bounds[seg], self.bounds[seg + 1] - 1)
+        y_lo = arr_y[idx]
+        sub_idx = (val_y - y_lo) / (arr_y[idx + 1] - y_lo)
+        frac_x = arr_x[idx] + sub_idx * (arr_x[idx + 1] - arr_x[idx])
+        return frac_x, idx, sub_idx
+
+
+_empty_sections = np.empty((0, 2), dtype=np.intp)
+
+
+def sections_reconnect(sections, reconnect_length):
+    """
+    Merge consecutive sections of an (M, 2) section array separated by gaps
+    of at most reconnect_length.
+    """
+    sections = np.asarray(sections, dtype=np.intp).reshape(-1, 2)
+    if len(sections) < 2 or reconnect_length is None:
+        return sections
+    keep = (sections[1:, 0] - sections[:-1, 1]) > reconnect_length
+    starts = np.concatenate([sections[:1, 0], sections[1:, 0][keep]])
+    ends = np.concatenate([sections[:-1, 1][keep], sections[-1:, 1]])
+    return np.stack([starts, ends], axis=-1)
+
+
+def generate_sections_array(barray, reconnect_length=None, num_threads=None):
+    """
+    Find the sections where the boolean array barray is True. Returns an
+    (M, 2) integer array of half-open [start, end) index intervals. Sections
+    separated by gaps of at most reconnect_length are merged. Long masks are
+    scanned by num_threads threads (see set_num_threads).
+    """
+    barray = np.asarray(barray, dtype=bool)
+    if len(barray) == 0:
+        return _empty_sections
+    threads = parallel_threads(len(barray), len(barray), num_threads)
+    if threads > 1:
+        # chunks overlap by one element so every transition is found once
+        bounds = np.linspace(0, len(barray) - 1, threads + 1).astype(int)
+        parts = [None] * threads
+
+        def run(sl):
+            for idx in range(sl.start, sl.stop):
+                lo, hi = bounds[idx], bounds[idx + 1]
+                chunk = barray[lo : hi + 1]
+                parts[idx] = np.flatnonzero(chunk[1:] != chunk[:-1]) + (lo + 1)
+
+        parallel_slices(run, threads, threads)
+        edges = np.concatenate(parts)
+    else:
+        edges = np.flatnonzero(barray[1:] != barray[:-1]) + 1
+    pre = [0] if barray[0] else []
+    post = [len(barray)] if barray[-1] else []
+    if pre or post:
+        edges = np.concatenate([pre, edges, post]).astype(np.intp)
+    return sections_reconnect(edges.reshape(-1, 2), reconnect_length)
+
+
 def generate_sections(barray, reconnect_length=None):
-    Dbarray = barray[1:] ^ barray[:-1]
-    args = np.argwhere(Dbarray).T[0, :] + 1
-    pargs = []
-    if barray[0]:
-        pargs.append([0])
-    pargs.append(args)
-    if barray[-1]:
-        pargs.append([len(barray) - 1])
-    if len(pargs) > 1:
-        args = np.concatenate(pargs)
-    assert len(args) % 2 == 0
-    sections = list(zip(args[::2], args[1::2]))
-    if (len(sections) > 0) and (reconnect_length is not None):
-        disconnects = [sections[0][0]]
-        for idx in range(1, len(sections)):
-            _, eidx = sections[idx - 1]
-            sidx, _ = sections[idx]
-            if (sidx - eidx) > reconnect_length:
-                disconnects.append(eidx)
-                disconnects.append(sidx)
-        disconnects.append(sections[-1][-1])
-        sections = list(zip(disconnects[0::2], disconnects[1::2]))
-    return sections
+    """
+    As generate_sections_array, but returning a list of (start, end) tuples.
+    A section which runs to the end of barray ends at len(barray) - 1.
+    """
+    sections = generate_sections_array(barray, reconnect_length=reconnect_length)
+    if len(sections) > 0 and barray[-1]:
+        sections[-1, 1] -= 1
+    return list(zip(sections[:, 0], sections[:, 1]))
 
 
 def generate_antisections(idx_start, idx_end, sections):
-    if not sections:
+    if len(sections) == 0:
         return [(idx_start, idx_end)]
-    disconnects = []
-    for section in sections:
-        disconnects.extend(section)
+    disconnects = np.concatenate([[idx_start], np.ravel(sections), [idx_end]])
+    pairs = disconnects.reshape(-1, 2)
+    if pairs[0, 0] == pairs[0, 1]:
+        pairs = pairs[1:]
+    if len(pairs) > 0 and pairs[-1, 0] == pairs[-1, 1]:
+        pairs = pairs[:-1]
+    return list(zip(pairs[:, 0], pairs[:, 1]))
 
-    if disconnects[0] == idx_start:
-        disconnects = disconnects[1:]
-    else:
-        disconnects.insert(0, idx_start)
 
-    if disconnects[-1] == idx_end:
-        disconnects = disconnects[:-1]
-    else:
-        disconnects.append(idx_end)
-    return list(zip(disconnects[0::2], disconnects[1::2]))
+def _sections_coverage(section_list, count, merge_touching):
+    """
+    Sweep over the start (+1) and end (-1) events of all of the sections,
+    returning the intervals covered by at least count of them.
+    """
+    section_list = [
+        np.asarray(sec, dtype=np.intp).reshape(-1, 2) for sec in section_list
+    ]
+    sections = np.concatenate(section_list)
+    if len(sections) == 0:
+        return _empty_sections
+    pos = sections.T.reshape(-1)
+    delta = np.repeat(np.array([1, -1], dtype=np.intp), len(sections))
+    # at equal positions, starts first merges touching intervals while ends
+    # first keeps them apart
+    order = np.lexsort((-delta if merge_touching else delta, pos))
+    pos = pos[order]
+    inside = np.cumsum(delta[order]) >= count
+    change = np.flatnonzero(inside[1:] != inside[:-1]) + 1
+    if inside[0]:
+        change = np.concatenate([[0], change])
+    result = pos[change].reshape(-1, 2)
+    return result[result[:, 0] < result[:, 1]]
+
+
+def sections_union(*section_arrays):
+    """
+    Union of (M, 2) section arrays, returned sorted, disjoint and with
+    overlapping or touching sections merged.
+    """
+    return _sections_coverage(section_arrays, 1, merge_touching=True)
 
 
-def matrix_stack(arr, dtype=None, **kwargs):
+def sections_intersection(*section_arrays):
+    """
+    Intersection of (M, 2) section arrays. Each array may be unsorted or
+    overlap itself.
+    """
+    section_arrays = [sections_union(sec) for sec in section_arrays]
+    return _sections_coverage(section_arrays, len(section_arrays), merge_touching=False)
+
+
+def sections_complement(sections, idx_start, idx_end):
+    """
+    The sections of [idx_start, idx_end) not covered by the (M, 2) section
+    array sections, as an (M, 2) array without empty sections.
+    """
+    sections = sections_union(sections)
+    bounds = np.concatenate(
+        [[idx_start], np.clip(sections, idx_start, idx_end).reshape(-1), [idx_end]]
+    ).astype(np.intp)
+    result = bounds.reshape(-1, 2)
+    return result[result[:, 0] < result[:, 1]]
+
+
+class SectionStream(object):
+    """
+    Streaming form of generate_sections_array, for masks too large to hold
+    at once. Feed consecutive chunks of the mask to update, which returns
+    the (M, 2) array of sections completed so far in absolute indices, and
+    call finish after the last chunk for the remaining sections.
+
+    A section open at the end of a chunk, and with reconnect_length the last
+    completed section, are carried over to the next chunk.
+    """
+
+    def __init__(self, reconnect_length=None):
+        self.reconnect_length = reconnect_length
+        self.offset = 0
+        self.open_start = None
+        self.pending = None
+        self.last = None
+
+    def update(self, chunk):
+        chunk = np.asarray(chunk, dtype=bool)
+        N = len(chunk)
+        if N == 0:
+            return _empty_sections
+        edges = np.flatnonzero(chunk[1:] != chunk[:-1]) + (1 + self.offset)
+        first = bool(chunk[0])
+        pre = []
+        if self.open_start is not None:
+            pre.append(self.open_start)
+        if first != bool(self.last):
+            pre.append(self.offset)
+        edges = np.concatenate([pre, edges]).astype(np.intp)
+
+        if chunk[-1]:
+            self.open_start = edges[-1]
+            edges = edges[:-1]
+        else:
+            self.open_start = None
+        self.offset += N
+        self.last = bool(chunk[-1])
+        return self._emit(edges.reshape(-1, 2), final=False)
+
+    def _emit(self, sections, final):
+        if self.reconnect_length is None:
+            return sections
+        if self.pending is not None:
+            sections = np.concatenate([self.pending, sections])
+        sections = sections_reconnect(sections, self.reconnect_length)
+        if final or len(sections) == 0:
+            self.pending = None
+            return sections
+        # the last section may still reconnect to the next one
+        self.pending = sections[-1:]
+        return sections[:-1]
+
+    def finish(self):
+        sections = _empty_sections
+        if self.open_start is not None:
+            sections = np.array([[self.open_start, self.offset]], dtype=np.intp)
+            self.open_start = None
+        return self._emit(sections, final=True)
+
+
+def generate_sections_chunked(barray, reconnect_length=None, chunk_size=2**24):
+    """
+    generate_sections_array over barray in chunks of chunk_size samples, so
+    that barray may be a memmap or HDF5 dataset much larger than memory.
+    """
+    stream = SectionStream(reconnect_length=reconnect_length)
+    results = []
+    for idx in range(0, len(barray), chunk_size):
+        results.append(stream.update(barray[idx : idx + chunk_size]))
+    results.append(stream.finish())
+    return np.concatenate(results)
+
+
+class PhaseUnwrapStream(object):
+    """
+    Streaming phase unwrapping of data arriving in blocks along axis. The
+    last phase and the accumulated wraps of each trace are carried between
+    blocks, so memory does not grow with the length of the stream.
+
+    The concatenated output of update matches, to rounding,
+    continuous_phase(data, op_idx=0, shiftmod=None, center=False) of the
+    concatenated blocks. The modulus of shiftmod and the centering offset
+    depend on data after each point, so they cannot be applied causally.
+    """
+
+    def __init__(self, sep=(1.01) * np.pi, deg=False, axis=-1):
+        self.sep = abs(sep)
+        self.deg = deg
+        self.axis = axis
+        self.prev = None
+        self.turns = None
+
+    def update(self, block):
+        """
+        Returns the unwrapped phase of block, with the shape of block
+        """
+        raw = np.moveaxis(np.angle(block), self.axis, -1)
+        if raw.shape[-1] == 0:
+            return np.moveaxis(raw, -1, self.axis)
+        if self.prev is None:
+            diff = np.diff(raw, axis=-1)
+            turns = np.zeros(raw.shape[:-1] + (1,), dtype=np.int64)
+        else:
+            diff = np.diff(np.concatenate([self.prev, raw], axis=-1), axis=-1)
+            turns = self.turns
+        jumps = (diff < -self.sep).astype(np.int64) - (diff > self.sep)
+        if self.prev is None:
+            before = np.concatenate([turns, turns + np.cumsum(jumps, axis=-1)], axis=-1)
+        else:
+            before = turns + np.cumsum(jumps, axis=-1)
+        self.prev = raw[..., -1:]
+        self.turns = before[..., -1:]
+
+        value = raw + (before * (2 * np.pi)).astype(raw.dtype, copy=False)
+        if self.deg:
+            value *= 180.0 / np.pi
+        return np.moveaxis(value, -1, self.axis)
+
+
+class GroupDelayStream(object):
+    """
+    Streaming group_delay of data arriving in blocks along axis, with the
+    matching blocks of the 1-D frequencies F. The last sample and frequency
+    are carried over to compute the difference across block boundaries.
+
+    update returns the F_diff and delay of the differences completed by the
+    block, which concatenate to exactly the batch group_delay result.
+    """
+
+    def __init__(self, mult=3e8, axis=-1):
+        self.mult = mult
+        self.axis = axis
+        self.prev = None
+        self.prev_F = None
+
+    def update(self, F, block):
+        F = np.asarray(F)
+        block = np.moveaxis(np.asarray(block), self.axis, -1)
+        if self.prev is not None:
+            F = np.concatenate([self.prev_F, F])
+            block = np.concatenate([self.prev, block], axis=-1)
+        if block.shape[-1] == 0:
+            return F[1:], np.moveaxis(
+                np.empty(block.shape, dtype=np.angle(block.flat[:0]).dtype),
+                -1,
+                self.axis,
+            )
+        self.prev = block[..., -1:]
+        self.prev_F = F[-1:]
+        F_diff, delay = group_delay(F, block, mult=self.mult, axis=-1)
+        return F_diff, np.moveaxis(delay, -1, self.axis)
+
+
+def matrix_stack(arr, dtype=None, out=None, num_threads=None, precision=None, **kwargs):
     """
     This routing allows one to construct 2D matrices out of heterogeneously
     shaped inputs. it should be called with a list, of list of np.array objects
@@ -344,7 +1619,13 @@ def matrix_stack(arr, dtype=None, **kwargs):
 
     This allows using the matrix-multiply "@" operator for many more
     constructions, as it multiplies only in the last-two-axis. Similarly,
-    np.linalg.inv() also inverts only in the last two axis.
+    np.linalg.inv() also inverts only in the last two axis. For large stacks,
+    batched_inv, batched_solve and batched_det do so in bounded memory.
+
+    If out is given, it must have the broadcast shape and is filled in place.
+    For repeated construction of same-shaped matrices see matrix_stack_plan.
+    Large stacks are filled by num_threads threads (see set_num_threads).
+    Without dtype, the dtype follows the precision policy (see set_precision).
     """
     Nrows = len(arr)
     Ncols = len(arr[0])
@@ -358,13 +1639,35 @@ def matrix_stack(arr, dtype=None, **kwargs):
             dtypes.append(kdm.dtype)
 
     if dtype is None:
-        dtype = np.result_type(*vals)
+        dtype = precision_dtype(np.result_type(*vals), precision)
     bc = broadcast_shapes(vals)
 
-    if len(bc) == 0:
-        return np.array(arr)
-
-    Marr = np.empty(bc + (Nrows, Ncols), dtype=dtype, **kwargs)
+    if out is not None:
+        if out.shape != bc + (Nrows, Ncols):
+            raise ValueError(
+                "out has shape {}, but {} is required".format(
+                    out.shape, bc + (Nrows, Ncols)
+                )
+            )
+        Marr = out
+    elif len(bc) == 0:
+        return np.array(arr, dtype=dtype)
+    else:
+        Marr = np.empty(bc + (Nrows, Ncols), dtype=dtype, **kwargs)
+
+    threads = 1
+    if len(bc) > 0:
+        threads = parallel_threads(bc[0], Marr.size, num_threads)
+    if threads > 1:
+        # each thread fills its part of the leading axis
+        def run(sl):
+            for idx, kdm in enumerate(vals):
+                if kdm.ndim == len(bc) and kdm.shape[0] != 1:
+                    kdm = kdm[sl]
+                Marr[sl, ..., idx // Ncols, idx % Ncols] = kdm
+
+        parallel_slices(run, bc[0], threads)
+        return Marr
 
     for r_idx, row in enumerate(arr):
         for c_idx, kdm in enumerate(row):
@@ -372,7 +1675,9 @@ def matrix_stack(arr, dtype=None, **kwargs):
     return Marr
 
 
-def vector_stack(arr, dtype=None, **kwargs):
+def vector_stack(
+    arr, dtype=None, out=None, num_threads=None, precision=None, **kwargs
+):
     """
     This routing allows one to construct 1D matrices out of heterogeneously
     shaped inputs. it should be called with a list, of list of np.array objects
@@ -393,6 +1698,11 @@ def vector_stack(arr, dtype=None, **kwargs):
     This allows using the matrix-multiply "@" operator for many more
     constructions, as it multiplies only in the last-two-axis. Similarly,
     np.linalg.inv() also inverts only in the last two axis.
+
+    If out is given, it must have the broadcast shape and is filled in place.
+    For repeated construction of same-shaped vectors see vector_stack_plan.
+    Large stacks are filled by num_threads threads (see set_num_threads).
+    Without dtype, the dtype follows the precision policy (see set_precision).
     """
     Nrows = len(arr)
     vals = []
@@ -403,55 +1713,625 @@ def vector_stack(arr, dtype=None, **kwargs):
         dtypes.append(rVal.dtype)
 
     if dtype is None:
-        dtype = np.result_type(*vals)
+        dtype = precision_dtype(np.result_type(*vals), precision)
     bc = broadcast_shapes(vals)
 
-    if len(bc) == 0:
-        return np.array(arr)
+    if out is not None:
+        if out.shape != bc + (Nrows,):
+            raise ValueError(
+                "out has shape {}, but {} is required".format(out.shape, bc + (Nrows,))
+            )
+        Marr = out
+    elif len(bc) == 0:
+        return np.array(arr, dtype=dtype)
+    else:
+        Marr = np.empty(bc + (Nrows, ), dtype=dtype, **kwargs)
+
+    threads = 1
+    if len(bc) > 0:
+        threads = parallel_threads(bc[0], Marr.size, num_threads)
+    if threads > 1:
+
+        def run(sl):
+            for r_idx, rVal in enumerate(vals):
+                if rVal.ndim == len(bc) and rVal.shape[0] != 1:
+                    rVal = rVal[sl]
+                Marr[sl, ..., r_idx] = rVal
 
-    Marr = np.empty(bc + (Nrows, ), dtype=dtype, **kwargs)
+        parallel_slices(run, bc[0], threads)
+        return Marr
 
     for r_idx, rVal in enumerate(arr):
         Marr[..., r_idx] = rVal
     return Marr
 
 
+class StackPlan(object):
+    """
+    Cached layout for repeatedly building matrices (or vectors) of the same
+    structure with matrix_stack (vector_stack). The broadcast shape, dtype and
+    the positions and values of the scalar (constant) entries are determined
+    once from an example. Buffers created by the plan have the constants
+    already filled. Passing filled=True to build declares that out still
+    holds them, so each build only copies the array-valued entries.
+
+    example
+
+    plan = matrix_stack_plan([[A, 0], [1, B]])
+    M = plan.empty()
+    for A, B in ...:
+        plan.build([[A, 0], [1, B]], out=M, filled=True)
+
+    With check=True (the default), build verifies that the constants and
+    array dtypes are compatible with the plan. This is cheap compared to the
+    copies, but may be disabled in the tightest loops.
+
+    Without dtype, the dtype follows the precision policy as in matrix_stack.
+    """
+
+    def __init__(self, arr, dtype=None, vector=False, precision=None, **kwargs):
+        self.vector = vector
+        if vector:
+            entries = [((r_idx,), v) for r_idx, v in enumerate(arr)]
+            self.block_shape = (len(arr),)
+        else:
+            Ncols = len(arr[0])
+            entries = []
+            for r_idx, row in enumerate(arr):
+                assert len(row) == Ncols
+                for c_idx, v in enumerate(row):
+                    entries.append(((r_idx, c_idx), v))
+            self.block_shape = (len(arr), Ncols)
+
+        vals = [np.asarray(v) for _, v in entries]
+        if dtype is None:
+            dtype = precision_dtype(np.result_type(*vals), precision)
+        self.dtype = np.dtype(dtype)
+        self.bc = broadcast_shapes(vals)
+        self.shape = self.bc + self.block_shape
+        self.kwargs = kwargs
+
+        # (index, value) of the scalar entries and the indices of array entries
+        self.constants = []
+        self.variables = []
+        for (idx, _), v in zip(entries, vals):
+            if v.ndim == 0:
+                self.constants.append((idx, v.item()))
+            else:
+                self.variables.append(idx)
+
+    def empty(self):
+        """
+        A new buffer with the constant entries filled.
+        """
+        out = np.empty(self.shape, dtype=self.dtype, **self.kwargs)
+        self.fill_constants(out)
+        return out
+
+    def fill_constants(self, out):
+        for idx, v in self.constants:
+            out[(Ellipsis,) + idx] = v
+        return out
+
+    def _entry(self, arr, idx):
+        if self.vector:
+            return arr[idx[0]]
+        return arr[idx[0]][idx[1]]
+
+    def build(self, arr, out=None, check=True, filled=False):
+        """
+        Construct the stacked array from arr, which must have the structure
+        of the example the plan was made from. If out is given, it must have
+        the plan shape and is filled in place. The constants are written into
+        out on every call, unless filled=True declares that out came from
+        empty() or fill_constants() of this plan and its constant entries
+        have not been modified since.
+        """
+        if out is None:
+            out = self.empty()
+        else:
+            if out.shape != self.shape:
+                raise ValueError(
+                    "out has shape {}, but {} is required".format(out.shape, self.shape)
+                )
+            if not filled:
+                self.fill_constants(out)
+
+        if check:
+            for idx, v in self.constants:
+                e = self._entry(arr, idx)
+                if np.ndim(e) != 0:
+                    raise ValueError(
+                        "entry {} is an array, but the plan has the constant {}".format(
+                            idx, v
+                        )
+                    )
+                if not np.all(np.asarray(e) == v):
+                    raise ValueError(
+                        "entry {} differs from the constant {} of the plan".format(
+                            idx, v
+                        )
+                    )
+            for idx in self.variables:
+                v = self._entry(arr, idx)
+                if not np.can_cast(np.result_type(v), self.dtype, casting="same_kind"):
+                    raise TypeError(
+                        "entry {} of dtype {} can't be stored as {}".format(
+                            idx, np.result_type(v), self.dtype
+                        )
+                    )
+
+        for idx in self.variables:
+            out[(Ellipsis,) + idx] = self._entry(arr, idx)
+        return out
+
+
+def matrix_stack_plan(arr, dtype=None, precision=None, **kwargs):
+    """
+    Create a StackPlan to repeatedly build matrices with the structure of arr,
+    see matrix_stack.
+    """
+    return StackPlan(arr, dtype=dtype, vector=False, precision=precision, **kwargs)
+
+
+def vector_stack_plan(arr, dtype=None, precision=None, **kwargs):
+    """
+    Create a StackPlan to repeatedly build vectors with the structure of arr,
+    see vector_stack.
+    """
+    return StackPlan(arr, dtype=dtype, vector=True, precision=precision, **kwargs)
+
+
 def broadcast_deep(mlist):
     """
     Performs the same operation as np.broadcast, but does not use *args
     (takes a list of numpy arrays instead) it also can operate on arbitrarily
-    long lists (rather than be limited by 32). The partial ordering on
-    dtype broadcasting allows this algorithm to be recursive.
+    long lists (rather than be limited by 32).
+
+    Arrays which already have the broadcast shape are returned as-is, only
+    the others are wrapped in (read-only) np.broadcast_to views.
     """
     bc = broadcast_shapes(mlist)
-    return [np.broadcast_to(m, bc) for m in mlist]
+    return [
+        np.asarray(m) if np.shape(m) == bc else np.broadcast_to(m, bc) for m in mlist
+    ]
+
+
+# frozenset of shapes -> broadcast shape
+_broadcast_cache = dict()
+_broadcast_cache_max = 1024
+
+
+def _broadcast_shape_set(shapes):
+    """
+    Reduce a collection of shape tuples into their broadcast shape, applying
+    the numpy broadcasting rules one axis at a time.
+    """
+    nd = max(len(s) for s in shapes)
+    bc = [1] * nd
+    for shape in shapes:
+        off = nd - len(shape)
+        for idx, n in enumerate(shape):
+            if n != 1:
+                b = bc[off + idx]
+                if b == 1:
+                    bc[off + idx] = n
+                elif b != n:
+                    raise ValueError(
+                        "shape mismatch: objects cannot be broadcast to a single shape."
+                        " Mismatch is between {} and {}".format(shape, tuple(bc))
+                    )
+    return tuple(bc)
 
 
 def broadcast_shapes(mlist):
     """
     Finds the common shape of a list of arrays, such that broadcasting into
     that shape will succeed.
+
+    This makes a single pass collecting the distinct shapes, which are then
+    reduced directly. Long lists usually hold only a few distinct shapes,
+    and the result for each set of them is cached.
     """
-    # do a huge, deep broadcast of all values
-    idx = 0
-    bc = None
-    while idx < len(mlist):
-        if idx == 0 or bc == ():
-            v = mlist[idx : idx + 32]
-            bc = np.broadcast_shapes(*[_.shape for _ in v])
-            idx += 32
-        else:
-            v = mlist[idx : idx + 31]
-            # including bc breaks broadcast unless shape is not trivial
-            bc = np.broadcast_shapes(bc, *[_.shape for _ in v])
-            idx += 31
+    if len(mlist) == 0:
+        return None
+    try:
+        shapes = frozenset([m.shape for m in mlist])
+    except AttributeError:
+        # also allow scalars and lists
+        shapes = frozenset([np.shape(m) for m in mlist])
+    bc = _broadcast_cache.get(shapes, None)
+    if bc is None:
+        bc = _broadcast_shape_set(shapes)
+        if len(_broadcast_cache) >= _broadcast_cache_max:
+            _broadcast_cache.clear()
+        _broadcast_cache[shapes] = bc
     return bc
 
 
-def matrix_stack_id(arr, **kwargs):
+def matrix_stack_id(arr, sparse=False, **kwargs):
+    if sparse:
+        entries = {(idx, idx): a for idx, a in enumerate(arr)}
+        return BlockStack(entries, (len(arr), len(arr)), **kwargs)
     arrs = []
     for idx, a in enumerate(arr):
         lst = [0] * len(arr)
         lst[idx] = a
         arrs.append(lst)
     return matrix_stack(arrs, **kwargs)
+
+
+def _is_zero(v):
+    if v is None:
+        return True
+    if isinstance(v, np.ndarray) and v.ndim > 0:
+        return False
+    return v == 0
+
+
+class BlockStack(object):
+    """
+    Block-sparse version of a matrix_stack result. Rather than broadcasting
+    every entry into a dense (..., Nrows, Ncols) array, the entries are kept
+    as given: zeros are not stored at all and scalars (such as identity
+    entries) stay scalars. Only the array-valued entries hold memory.
+
+    Supports "@" with other BlockStacks (staying sparse) or dense matrix
+    stacks, and inv/solve/det which act independently on each of the
+    diagonal blocks (connected components) of the sparsity structure, so
+    a block-diagonal system never forms the full dense matrix. dense()
+    constructs the equivalent matrix_stack array.
+
+    Create them with matrix_stack_sparse or matrix_stack_id(arr, sparse=True).
+    """
+
+    def __init__(self, entries, shape, dtype=None, precision=None):
+        """
+        entries is a dictionary mapping (row, col) to scalars or arrays, with
+        missing entries being zero. The array entries are converted to the
+        precision policy (see set_precision), as is the dtype unless given.
+        """
+        self.Nrows, self.Ncols = shape
+        self.precision = precision
+        self.entries = dict()
+        for (r_idx, c_idx), v in entries.items():
+            if not (0 <= r_idx < self.Nrows and 0 <= c_idx < self.Ncols):
+                raise IndexError(
+                    "entry {} outside of shape {}".format((r_idx, c_idx), shape)
+                )
+            if v is None:
+                continue
+            if not isinstance(v, np.ndarray) and not np.isscalar(v):
+                # lists would otherwise be repeated rather than multiplied
+                v = np.asarray(v)
+            if _is_zero(v):
+                continue
+            if isinstance(v, np.ndarray):
+                if v.ndim == 0:
+                    v = v[()]
+                else:
+                    v = _as_precision(v, precision)
+            self.entries[(r_idx, c_idx)] = v
+
+        vals = [np.asarray(v) for v in self.entries.values()]
+        if dtype is None:
+            if vals:
+                dtype = precision_dtype(np.result_type(*vals), precision)
+            else:
+                dtype = precision_dtype(float, precision)
+        self.dtype = np.dtype(dtype)
+        self.bc = broadcast_shapes(vals) if vals else ()
+
+    @property
+    def shape(self):
+        return self.bc + (self.Nrows, self.Ncols)
+
+    @property
+    def nbytes(self):
+        """
+        Memory held by the array-valued entries
+        """
+        return sum(v.nbytes for v in self.entries.values() if isinstance(v, np.ndarray))
+
+    def __getitem__(self, idx):
+        return self.entries.get(idx, 0)
+
+    def dense(self, out=None):
+        """
+        The equivalent dense matrix_stack array.
+        """
+        arr = [
+            [self.entries.get((r_idx, c_idx), 0) for c_idx in range(self.Ncols)]
+            for r_idx in range(self.Nrows)
+        ]
+        return matrix_stack(arr, dtype=self.dtype, out=out)
+
+    def __array__(self, dtype=None, copy=None):
+        arr = self.dense()
+        if dtype is not None:
+            arr = arr.astype(dtype, copy=False)
+        return arr
+
+    def __repr__(self):
+        return "{0}(shape={1}, dtype={2}, nonzero={3})".format(
+            self.__class__.__name__, self.shape, self.dtype, sorted(self.entries)
+        )
+
+    def _rows(self):
+        rows = dict()
+        for (r_idx, c_idx), v in self.entries.items():
+            rows.setdefault(r_idx, []).append((c_idx, v))
+        return rows
+
+    def _cols(self):
+        cols = dict()
+        for (r_idx, c_idx), v in self.entries.items():
+            cols.setdefault(c_idx, []).append((r_idx, v))
+        return cols
+
+    def __matmul__(self, other):
+        if isinstance(other, BlockStack):
+            if self.Ncols != other.Nrows:
+                raise ValueError(
+                    "inner dimensions {} and {} differ".format(self.Ncols, other.Nrows)
+                )
+            rows = other._rows()
+            prod = dict()
+            for (r_idx, j_idx), vA in self.entries.items():
+                for c_idx, vB in rows.get(j_idx, ()):
+                    term = vA * vB
+                    acc = prod.get((r_idx, c_idx), None)
+                    prod[(r_idx, c_idx)] = term if acc is None else acc + term
+            return self.__class__(
+                prod, (self.Nrows, other.Ncols), precision=self.precision
+            )
+
+        other = np.asarray(other)
+        if other.ndim < 2 or other.shape[-2] != self.Ncols:
+            raise ValueError(
+                "dense operand must be a matrix stack with {} rows".format(self.Ncols)
+            )
+        bc = np.broadcast_shapes(self.bc, other.shape[:-2])
+        dtype = np.result_type(self.dtype, other.dtype)
+        out = np.zeros(bc + (self.Nrows, other.shape[-1]), dtype=dtype)
+        for (r_idx, j_idx), v in self.entries.items():
+            out[..., r_idx, :] += np.asarray(v)[..., np.newaxis] * other[..., j_idx, :]
+        return out
+
+    def __rmatmul__(self, other):
+        other = np.asarray(other)
+        if other.ndim < 2 or other.shape[-1] != self.Nrows:
+            raise ValueError(
+                "dense operand must be a matrix stack with {} columns".format(
+                    self.Nrows
+                )
+            )
+        bc = np.broadcast_shapes(self.bc, other.shape[:-2])
+        dtype = np.result_type(self.dtype, other.dtype)
+        out = np.zeros(bc + (other.shape[-2], self.Ncols), dtype=dtype)
+        for (j_idx, c_idx), v in self.entries.items():
+            out[..., :, c_idx] += other[..., :, j_idx] * np.asarray(v)[..., np.newaxis]
+        return out
+
+    def components(self):
+        """
+        Index lists of the independent diagonal blocks of a square BlockStack,
+        found as the connected components of the nonzero structure.
+        """
+        if self.Nrows != self.Ncols:
+            raise ValueError("BlockStack must be square")
+        parent = list(range(self.Nrows))
+
+        def find(idx):
+            while parent[idx] != idx:
+                parent[idx] = parent[parent[idx]]
+                idx = parent[idx]
+            return idx
+
+        for r_idx, c_idx in self.entries:
+            pr, pc = find(r_idx), find(c_idx)
+            if pr != pc:
+                parent[max(pr, pc)] = min(pr, pc)
+
+        comps = dict()
+        for idx in range(self.Nrows):
+            comps.setdefault(find(idx), []).append(idx)
+        return list(comps.values())
+
+    def _block_dense(self, comp):
+        arr = [
+            [self.entries.get((r_idx, c_idx), 0) for c_idx in comp] for r_idx in comp
+        ]
+        return matrix_stack(arr, dtype=self.dtype)
+
+    def inv(self):
+        """
+        Inverse, computed independently on each diagonal block.
+        """
+        inv_entries = dict()
+        for comp in self.components():
+            if len(comp) == 1:
+                (idx,) = comp
+                v = self.entries.get((idx, idx), None)
+                if v is None:
+                    raise np.linalg.LinAlgError("Singular matrix")
+                inv_entries[(idx, idx)] = 1 / v
+            else:
+                Minv = np.linalg.inv(self._block_dense(comp))
+                for a_idx, r_idx in enumerate(comp):
+                    for b_idx, c_idx in enumerate(comp):
+                        inv_entries[(r_idx, c_idx)] = Minv[..., a_idx, b_idx]
+        return self.__class__(
+            inv_entries, (self.Nrows, self.Ncols), precision=self.precision
+        )
+
+    def solve(self, b):
+        """
+        Solve self @ x = b for a vector stack b of shape (..., N), such as from
+        vector_stack, independently on each diagonal block.
+        """
+        b = np.asarray(b)
+        if b.shape[-1] != self.Nrows:
+            raise ValueError(
+                "b must be a vector stack with {} entries".format(self.Nrows)
+            )
+        bc = np.broadcast_shapes(self.bc, b.shape[:-1])
+        dtype = np.result_type(self.dtype, b.dtype, float)
+        x = np.empty(bc + (self.Nrows,), dtype=dtype)
+        for comp in self.components():
+            if len(comp) == 1:
+                (idx,) = comp
+                v = self.entries.get((idx, idx), None)
+                if v is None:
+                    raise np.linalg.LinAlgError("Singular matrix")
+                x[..., idx] = b[..., idx] / v
+            else:
+                M = self._block_dense(comp)
+                b_sub = np.broadcast_to(b[..., comp], bc + (len(comp),))
+                M = np.broadcast_to(M, bc + M.shape[-2:])
+                x[..., comp] = np.linalg.solve(M, b_sub[..., np.newaxis])[..., 0]
+        return x
+
+    def det(self):
+        """
+        Determinant, as the product of the determinants of the diagonal blocks.
+        """
+        det = 1
+        for comp in self.components():
+            if len(comp) == 1:
+                (idx,) = comp
+                det = det * self.entries.get((idx, idx), 0)
+            else:
+                det = det * np.linalg.det(self._block_dense(comp))
+        return det
+
+
+def matrix_stack_sparse(arr, dtype=None, precision=None):
+    """
+    The block-sparse equivalent of matrix_stack, returning a BlockStack that
+    keeps zero and scalar entries unbroadcast.
+    """
+    Nrows = len(arr)
+    Ncols = len(arr[0])
+    entries = dict()
+    for r_idx, row in enumerate(arr):
+        assert len(row) == Ncols
+        for c_idx, kdm in enumerate(row):
+            entries[(r_idx, c_idx)] = kdm
+    return BlockStack(entries, (Nrows, Ncols), dtype=dtype, precision=precision)
+
+
+def _batched_linalg(
+    func, args, core_shapes, out_core, dtype, out, chunk_bytes, num_threads
+):
+    """
+    Apply func to chunks along the leading axis of the broadcast batch shape
+    of args, writing into out. core_shapes gives the number of trailing core
+    dimensions of each argument and out_core is the core shape of the output.
+    """
+    batch = np.broadcast_shapes(
+        *[a.shape[: a.ndim - nc] for a, nc in zip(args, core_shapes)]
+    )
+    args = [
+        np.broadcast_to(a, batch + a.shape[a.ndim - nc :])
+        for a, nc in zip(args, core_shapes)
+    ]
+    if out is None:
+        out = np.empty(batch + out_core, dtype=dtype)
+    elif out.shape != batch + out_core:
+        raise ValueError(
+            "out has shape {}, but {} is required".format(out.shape, batch + out_core)
+        )
+
+    if len(batch) == 0:
+        out[...] = func(*args)
+        return out
+
+    # bytes of work per index of the leading axis
+    row_bytes = sum(a[0].size * a.itemsize for a in args) + out[0].nbytes
+    rows = int(max(1, chunk_bytes // max(row_bytes, 1)))
+    N = batch[0]
+    starts = range(0, N, rows)
+
+    def run(idx):
+        sl = slice(idx, min(idx + rows, N))
+        out[sl] = func(*[a[sl] for a in args])
+
+    if num_threads is None:
+        num_threads = _num_threads
+    if num_threads <= 1 or len(starts) <= 1:
+        for idx in starts:
+            run(idx)
+    else:
+        # numpy releases the GIL within the LAPACK calls
+        pool = _get_thread_pool(num_threads)
+        for future in [pool.submit(run, idx) for idx in starts]:
+            future.result()
+    return out
+
+
+def batched_inv(M, out=None, chunk_bytes=2**22, num_threads=None):
+    """
+    np.linalg.inv over the last two axes of M (such as from matrix_stack),
+    processed in chunks of about chunk_bytes along the leading axis so that
+    the LAPACK temporaries stay bounded and in cache. The result is written
+    into out, which may be preallocated. The chunks are processed in the
+    shared thread pool with num_threads, by default as set by
+    set_num_threads.
+    """
+    M = np.asarray(M)
+    dtype = np.result_type(M.dtype, np.float32)
+    return _batched_linalg(
+        np.linalg.inv,
+        [M],
+        [2],
+        M.shape[-2:],
+        dtype,
+        out,
+        chunk_bytes,
+        num_threads,
+    )
+
+
+def batched_solve(M, b, out=None, chunk_bytes=2**22, num_threads=None):
+    """
+    Solve M @ x = b for a matrix stack M of shape (..., N, N) and a vector
+    stack b of shape (..., N) (such as from vector_stack), broadcasting the
+    leading axes. Chunking, out and num_threads are as in batched_inv.
+    """
+    M = np.asarray(M)
+    b = np.asarray(b)
+
+    def solve(M, b):
+        return np.linalg.solve(M, b[..., np.newaxis])[..., 0]
+
+    dtype = np.result_type(M.dtype, b.dtype, np.float32)
+    return _batched_linalg(
+        solve,
+        [M, b],
+        [2, 1],
+        b.shape[-1:],
+        dtype,
+        out,
+        chunk_bytes,
+        num_threads,
+    )
+
+
+def batched_det(M, out=None, chunk_bytes=2**22, num_threads=None):
+    """
+    np.linalg.det over the last two axes of M. Chunking, out and num_threads
+    are as in batched_inv.
+    """
+    M = np.asarray(M)
+    dtype = np.result_type(M.dtype, np.float32)
+    return _batched_linalg(
+        np.linalg.det,
+        [M],
+        [2],
+        (),
+        dtype,
+        out,
+        chunk_bytes,
+        num_threads,
+    )
@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@caltech.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+Out-of-core versions of the helpers in wield.utilities.np, for arrays larger
+than memory. Inputs may be np.memmap arrays (such as from
+file_io.load_dataset(..., mmap_mode="r")) or lazy h5py datasets, and are read
+in blocks of chunk_size samples along the processed axis. The state needed
+across block boundaries is carried over, so the results match the in-memory
+functions.
+
+Outputs are written into out, which may be a preallocated array or memmap,
+or a file name for which a .npy memmap is created. For h5py datasets only
+the last axis may be processed.
+"""
+import os
+import numpy as np
+
+from . import np as wnp
+
+
+CHUNK_SIZE = 2**20
+
+
+def _axis_last(arr, axis):
+    """
+    View arr with axis moved last, without reading lazy datasets
+    """
+    if isinstance(arr, np.ndarray):
+        return np.moveaxis(arr, axis, -1)
+    if axis not in (-1, len(arr.shape) - 1):
+        raise ValueError("only the last axis of non-numpy arrays may be processed")
+    return arr
+
+
+def _output(out, shape, dtype):
+    """
+    The output array for out, which is None for an in-memory array, a file
+    name for a new .npy memmap, or a preallocated array to check.
+    """
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+    if isinstance(out, (str, os.PathLike)):
+        return np.lib.format.open_memmap(
+            os.fspath(out), mode="w+", dtype=dtype, shape=shape
+        )
+    if out.shape != tuple(shape):
+        raise ValueError(
+            "out has shape {}, but {} is required".format(out.shape, shape)
+        )
+    return out
+
+
+def _chunks(N, chunk_size):
+    for idx in range(0, N, chunk_size):
+        yield slice(idx, min(idx + chunk_size, N))
+
+
+def is_sorted(X, chunk_size=CHUNK_SIZE):
+    """
+    wnp.is_sorted, reading X in chunks and stopping at the first unsorted one
+    """
+    prev = None
+    for sl in _chunks(len(X), chunk_size):
+        x = np.asarray(X[sl])
+        if prev is not None and prev > x[0]:
+            return False
+        if not wnp.is_sorted(x):
+            return False
+        prev = x[-1]
+    return True
+
+
+def domain_sort(X, *Y, out=None, chunk_size=CHUNK_SIZE):
+    """
+    Out-of-core wnp.domain_sort. If X is already sorted the inputs are
+    returned as-is. Otherwise the permutation is computed in memory (X and
+    its int64 permutation must fit) and X and each Y are gathered through it
+    one output chunk at a time.
+
+    out is a list of outputs for X and each Y, see the module documentation.
+    """
+    if is_sorted(X, chunk_size=chunk_size):
+        return [X] + list(Y)
+    sort_idxs = np.argsort(np.asarray(X))
+    if out is None:
+        out = [None] * (1 + len(Y))
+
+    output = []
+    for arr, arr_out in zip((X,) + Y, out):
+        if arr is None:
+            output.append(None)
+            continue
+        if len(arr) == 1:
+            output.append(arr)
+            continue
+        arr_out = _output(arr_out, arr.shape, arr.dtype)
+        for sl in _chunks(len(sort_idxs), chunk_size):
+            idxs = sort_idxs[sl]
+            if isinstance(arr, np.ndarray):
+                arr_out[sl] = arr[idxs]
+            else:
+                # h5py requires increasing indices for fancy indexing
+                order = np.argsort(idxs)
+                block = np.empty((len(idxs),) + arr.shape[1:], dtype=arr.dtype)
+                block[order] = arr[idxs[order]]
+                arr_out[sl] = block
+        output.append(arr_out)
+    return output
+
+
+def _searchsorted(X, value, side, chunk_size):
+    """
+    np.searchsorted on the sorted 1-D X. Lazy datasets, which np.searchsorted
+    would read in full, are bisected by reading single points X[idx] until
+    the range fits in one chunk, which is then read and searched.
+    """
+    if isinstance(X, np.ndarray):
+        return int(np.searchsorted(X, value, side=side))
+    lo = 0
+    hi = len(X)
+    while hi - lo > chunk_size:
+        mid = (lo + hi) // 2
+        x = X[mid]
+        if x < value or (side == "right" and x == value):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo + int(np.searchsorted(np.asarray(X[lo:hi]), value, side=side))
+
+
+def interval_limit(X_min, X_max, X, *Y, out=None, chunk_size=CHUNK_SIZE):
+    """
+    Out-of-core wnp.interval_limit. For sorted X the interval is located by
+    binary search, reading only a few pages of a memmap or a few chunks of a
+    dataset, and slices of the inputs are returned without copying. Checking
+    that X is sorted still reads it once. Otherwise the selection is made in
+    chunks into out, a list of outputs for X and each Y.
+    """
+    if is_sorted(X, chunk_size=chunk_size):
+        sl = slice(
+            _searchsorted(X, X_min, "left", chunk_size),
+            _searchsorted(X, X_max, "right", chunk_size),
+        )
+        sl = slice(sl.start, max(sl.start, sl.stop))
+        return (X[sl],) + tuple(y[sl] for y in Y)
+
+    # first pass counts the selection to size the outputs
+    count = 0
+    for sl in _chunks(len(X), chunk_size):
+        x = np.asarray(X[sl])
+        count += np.count_nonzero((x >= X_min) & (x <= X_max))
+
+    arrs = (X,) + Y
+    if out is None:
+        out = [None] * len(arrs)
+    outs = [
+        _output(arr_out, (count,) + arr.shape[1:], arr.dtype)
+        for arr, arr_out in zip(arrs, out)
+    ]
+    idx_out = 0
+    for sl in _chunks(len(X), chunk_size):
+        x = np.asarray(X[sl])
+        select = np.flatnonzero((x >= X_min) & (x <= X_max))
+        if len(select) == 0:
+            continue
+        out_sl = slice(idx_out, idx_out + len(select))
+        for arr, arr_out in zip(arrs, outs):
+            arr_out[out_sl] = np.asarray(arr[sl])[select]
+        idx_out += len(select)
+    return tuple(outs)
+
+
+def continuous_phase(
+    data,
+    op_idx=0,
+    sep=(1.01) * np.pi,
+    deg=False,
+    shiftmod=2,
+    axis=-1,
+    out=None,
+    chunk_size=CHUNK_SIZE,
+    center=True,
+):
+    """
+    Out-of-core wnp.continuous_phase, giving identical results. data is read
+    twice and out is written once, then updated in place if any trace needs
+    the final turn offset or deg is set.
+
+    The first pass counts the wraps of each trace, carrying the last phase
+    of each chunk across the boundary. The second pass writes the unwrapped
+    phase and counts the points below -pi/4, which decides the median test
+    without sorting. The average test uses the accumulated sum.
+    """
+    D = _axis_last(data, axis)
+    N = D.shape[-1]
+    out = _output(out, data.shape, np.angle(np.zeros((), dtype=data.dtype)).dtype)
+    O = _axis_last(out, axis)
+    if N == 0:
+        return out
+    sep = abs(sep)
+    op_idx = op_idx % N
+    traces = D.shape[:-1]
+
+    def mod(shift):
+        if shiftmod is None:
+            return shift
+        return ((shiftmod + shift) % (2 * shiftmod)) - shiftmod
+
+    # pass 1: total wraps and the wraps before op_idx, forward cumulative
+    # sums of the jumps
+    total = np.zeros(traces, dtype=np.int64)
+    total_op = np.zeros(traces, dtype=np.int64)
+    op_angle = None
+    prev = None
+    for sl in _chunks(N, chunk_size):
+        raw = np.angle(D[..., sl])
+        if prev is not None:
+            raw_ext = np.concatenate([prev[..., np.newaxis], raw], axis=-1)
+        else:
+            raw_ext = raw
+        diff = np.diff(raw_ext, axis=-1)
+        jumps = (diff < -sep).astype(np.int64) - (diff > sep)
+        if sl.start <= op_idx < sl.stop:
+            # jumps before the point op_idx
+            n_before = op_idx - sl.start + (0 if prev is None else 1)
+            total_op = total + np.sum(jumps[..., :n_before], axis=-1)
+            op_angle = raw[..., op_idx - sl.start]
+        total += np.sum(jumps, axis=-1)
+        has_jumps = np.any(jumps != 0, axis=-1)
+        if sl.start == 0:
+            has_wraps = has_jumps
+        else:
+            has_wraps |= has_jumps
+        prev = raw[..., -1]
+
+    # the shift of the reference point, as in continuous_phase. The shift is
+    # referenced to op_idx, so the reference point keeps its raw angle
+    shift_op = (mod(total - total_op) * (2 * np.pi)).astype(op_angle.dtype)
+    n_turns = np.where(
+        op_angle < -np.pi,
+        np.ceil((-np.pi - op_angle) / (2 * np.pi)),
+        0,
+    ) - np.where(
+        op_angle > np.pi,
+        np.ceil((op_angle - np.pi) / (2 * np.pi)),
+        0,
+    )
+    n_turns = np.where(has_wraps, n_turns, 0)
+    turns_offset = (2 * np.pi * n_turns)[..., np.newaxis]
+
+    # pass 2: write the unwrapped phase, tallying for the offset tests
+    n_below = np.zeros(traces, dtype=np.int64)
+    angle_sum = np.zeros(traces, dtype=np.float64)
+    prev = None
+    cum = np.zeros(traces, dtype=np.int64)
+    for sl in _chunks(N, chunk_size):
+        raw = np.angle(D[..., sl])
+        if prev is not None:
+            raw_ext = np.concatenate([prev[..., np.newaxis], raw], axis=-1)
+            diff = np.diff(raw_ext, axis=-1)
+        else:
+            diff = np.concatenate(
+                [np.zeros(traces + (1,), dtype=raw.dtype), np.diff(raw, axis=-1)],
+                axis=-1,
+            )
+        prev = raw[..., -1]
+        jumps = (diff < -sep).astype(np.int64) - (diff > sep)
+        # forward count of the jumps before each point
+        before = cum[..., np.newaxis] + np.cumsum(jumps, axis=-1)
+        cum = before[..., -1]
+        full_shift = (mod(total[..., np.newaxis] - before) * (2 * np.pi)).astype(
+            raw.dtype, copy=False
+        )
+        value = raw - full_shift
+        value += shift_op[..., np.newaxis]
+        value += turns_offset
+        n_below += np.count_nonzero(value < -np.pi / 4, axis=-1)
+        angle_sum += np.sum(value, axis=-1)
+        O[..., sl] = value
+
+    median_below = n_below >= N // 2 + 1
+    average_below = (angle_sum / N) < -np.pi / 4
+    offset = np.where(has_wraps, median_below, average_below) & center
+
+    # pass 3: apply the offset and degrees, only if needed
+    if deg or np.any(offset):
+        add = (np.pi * 2 * offset)[..., np.newaxis]
+        for sl in _chunks(N, chunk_size):
+            value = O[..., sl]
+            value += add
+            if deg:
+                value *= 180.0 / np.pi
+            O[..., sl] = value
+    return out
+
+
+def group_delay(F, data, mult=3e8, axis=-1, out=None, chunk_size=CHUNK_SIZE):
+    """
+    Out-of-core wnp.group_delay for a 1-D F. The last phase and frequency of
+    each chunk are carried over to compute the difference across the chunk
+    boundary. Returns F[1:] and out.
+    """
+    if len(F.shape) != 1:
+        raise ValueError("F must be 1-D")
+    D = _axis_last(data, axis)
+    N = D.shape[-1]
+    shape = list(data.shape)
+    shape[axis] = max(N - 1, 0)
+    out = _output(out, tuple(shape), np.angle(np.zeros((), dtype=data.dtype)).dtype)
+    O = _axis_last(out, axis)
+
+    prev = None
+    prev_F = None
+    for sl in _chunks(N, chunk_size):
+        block = np.asarray(D[..., sl])
+        F_chunk = np.asarray(F[sl])
+        if prev is not None:
+            block = np.concatenate([prev[..., np.newaxis], block], axis=-1)
+            F_chunk = np.concatenate([[prev_F], F_chunk])
+        prev = block[..., -1]
+        prev_F = F_chunk[-1]
+        if block.shape[-1] < 2:
+            continue
+        _, delay = wnp.group_delay(F_chunk, block, mult=mult, axis=-1)
+        start = sl.start - 1 if sl.start > 0 else 0
+        O[..., start : start + delay.shape[-1]] = delay
+    return F[1:], out
+
+
+def generate_sections(barray, reconnect_length=None, chunk_size=CHUNK_SIZE):
+    """
+    wnp.generate_sections_array over a memmap or dataset mask in chunks.
+    The (M, 2) section array is returned in memory.
+    """
+    return wnp.generate_sections_chunked(
+        barray, reconnect_length=reconnect_length, chunk_size=chunk_size
+    )
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@caltech.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+Checks that the parallel backend of wield.utilities.np really runs the
+requested number of threads concurrently. Each slice waits on a barrier for
+all of the others, which times out unless they run at the same time.
+"""
+import threading
+import numpy as np
+
+from wield.utilities import np as wnp
+
+
+def barrier_func(N_threads, idents):
+    barrier = threading.Barrier(N_threads, timeout=10)
+
+    def func(*args):
+        idents.add(threading.get_ident())
+        barrier.wait()
+
+    return func
+
+
+def test_parallel_slices_per_call():
+    """
+    A per-call num_threads above the global setting (default 1)
+    """
+    prev = wnp.set_num_threads(1)
+    try:
+        idents = set()
+        wnp.parallel_slices(barrier_func(4, idents), 8, 4)
+        assert len(idents) == 4
+    finally:
+        wnp.set_num_threads(prev)
+
+
+def test_parallel_slices_global():
+    prev = wnp.set_num_threads(3)
+    try:
+        idents = set()
+        wnp.parallel_slices(barrier_func(3, idents), 3, wnp.get_num_threads())
+        assert len(idents) == 3
+    finally:
+        wnp.set_num_threads(prev)
+
+
+def test_batched_linalg_per_call():
+    prev = wnp.set_num_threads(1)
+    try:
+        idents = set()
+        wait = barrier_func(4, idents)
+
+        def inv(M):
+            wait()
+            return np.linalg.inv(M)
+
+        M = np.eye(2) + np.zeros((4, 2, 2))
+        out = wnp._batched_linalg(inv, [M], [2], (2, 2), float, None, 1, 4)
+        assert len(idents) == 4
+        np.testing.assert_allclose(out, M)
+    finally:
+        wnp.set_num_threads(prev)
+
+
+def test_continuous_phase_threads():
+    """
+    The threaded result matches the single-threaded one
+    """
+    rng = np.random.default_rng(0)
+    data = np.exp(1j * np.cumsum(rng.normal(size=(16, 2**13)), axis=-1))
+    ref = wnp.continuous_phase(data, num_threads=1)
+    np.testing.assert_array_equal(wnp.continuous_phase(data, num_threads=4), ref)
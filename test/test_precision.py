@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@caltech.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+Bounds on the error of the single precision policy of wield.utilities.np
+against double precision.
+"""
+import numpy as np
+
+from wield.utilities import np as wnp
+
+
+def transfer_functions(N_traces=16, N_freq=10**4, seed=0):
+    """
+    Random complex transfer functions with many phase wraps
+    """
+    rng = np.random.default_rng(seed)
+    phase = np.cumsum(rng.normal(0, 0.5, (N_traces, N_freq)), axis=-1)
+    mag = rng.uniform(0.1, 10, (N_traces, N_freq))
+    return mag * np.exp(1j * phase)
+
+
+def rel_error(A, B):
+    return np.max(np.abs(A - B) / np.maximum(np.abs(B), 1))
+
+
+def test_continuous_phase():
+    data = transfer_functions()
+    ph_s = wnp.continuous_phase(data, precision="single")
+    ph_d = wnp.continuous_phase(data, precision="double")
+    assert ph_s.dtype == np.float32
+    # the turn offsets may be decided differently for traces at the
+    # threshold, so whole turns are ignored
+    d = ph_s - ph_d
+    assert np.max(np.abs((d + np.pi) % (2 * np.pi) - np.pi)) <= 1e-5
+
+
+def test_mag_phase_signed():
+    data = transfer_functions()
+    mag_s, ang_s = wnp.mag_phase_signed(data, deg=False, precision="single")
+    mag_d, ang_d = wnp.mag_phase_signed(data, deg=False, precision="double")
+    assert mag_s.dtype == np.float32
+    # near the branch at 3pi/4 the sign of mag may flip with a half turn
+    assert np.max(np.abs(np.abs(mag_s) - np.abs(mag_d)) / np.abs(mag_d)) <= 1e-6
+
+
+def test_group_delay():
+    data = transfer_functions()
+    F = np.linspace(1, 1e4, data.shape[-1])
+    gd_s = wnp.group_delay(F, data, mult=1, precision="single")[1]
+    gd_d = wnp.group_delay(F, data, mult=1, precision="double")[1]
+    # compared as the phase steps, the delay times the frequency step
+    assert np.max(np.abs(gd_s - gd_d) * np.diff(F)) <= 2e-6
+
+
+def test_logspaced():
+    F_s = wnp.logspaced(1e-3, 1e5, 10**5, precision="single")
+    F_d = wnp.logspaced(1e-3, 1e5, 10**5, precision="double")
+    assert F_s.dtype == np.float32
+    assert np.max(np.abs(F_s / F_d - 1)) <= 5e-6
+
+
+def test_matrix_stack():
+    a = transfer_functions()[0]
+    ms_s = wnp.matrix_stack([[a, 1], [0, a]], precision="single")
+    ms_d = wnp.matrix_stack([[a, 1], [0, a]], precision="double")
+    assert ms_s.dtype == np.complex64
+    assert rel_error(ms_s, ms_d) <= 1e-7
+
+
+def test_matrix_stack_plan():
+    a = transfer_functions()[0]
+    ms_d = wnp.matrix_stack([[a, 1], [0, a]], precision="double")
+    plan_s = wnp.matrix_stack_plan([[a, 1], [0, a]], precision="single")
+    M = plan_s.build([[a, 1], [0, a]])
+    assert M.dtype == np.complex64
+    assert rel_error(M, ms_d) <= 1e-7
+    plan_d = wnp.matrix_stack_plan([[a, 1], [0, a]], precision="double")
+    assert plan_d.dtype == np.complex128
+
+
+def test_BlockStack():
+    a = transfer_functions()[0]
+    bs_s = wnp.matrix_stack_sparse([[a, 1], [0, a]], precision="single")
+    bs_d = wnp.matrix_stack_sparse([[a, 1], [0, a]], precision="double")
+    assert bs_s.dtype == np.complex64 and bs_s[0, 0].dtype == np.complex64
+    assert bs_d.dtype == np.complex128
+    assert rel_error(bs_s.inv().dense(), bs_d.inv().dense()) <= 1e-6